@@ -0,0 +1,111 @@
+import os
+import random
+import shutil
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+import pillow_heif
+
+pillow_heif.register_heif_opener()
+
+# Extension and Pillow save arguments for each format in a mix
+FORMATS = {
+    'jpeg': ('.jpg', {'format': 'JPEG', 'quality': 90}),
+    'png': ('.png', {'format': 'PNG'}),
+    'heic': ('.heic', {'format': 'HEIF', 'quality': 80}),
+}
+
+# Distinct source images encoded per format; collection files are copies of these,
+# so a 10k-file collection doesn't take 10k encodes to build
+POOL_SIZE = 8
+
+
+def parse_mix(value):
+    """Parse 'jpeg=70,png=20,heic=10' into normalized weights"""
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip().lower()
+        if name not in FORMATS:
+            raise ValueError(f'Unknown format "{name}" (expected one of {", ".join(FORMATS)})')
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError('Format mix weights must add up to more than zero')
+    return {name: weight / total for name, weight in weights.items()}
+
+
+def parse_collections(value):
+    """Parse 'large=10000,small=50' into {name: photo count}"""
+    collections = {}
+    for part in value.split(','):
+        name, _, count = part.partition('=')
+        collections[name.strip()] = int(count)
+    return collections
+
+
+def _synthetic_image(width, height, rng):
+    # Gradients plus shapes: compresses like a photo, unlike flat colour
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    tint = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    img = Image.blend(img, tint, 0.5)
+    draw = ImageDraw.Draw(img)
+    for _ in range(24):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(20, max(21, width // 6))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    return img
+
+
+def build_pool(width, height, formats, seed=0):
+    """Encode POOL_SIZE distinct images per format; returns {format: [bytes]}"""
+    rng = random.Random(seed)
+    pool = {name: [] for name in formats}
+    for _ in range(POOL_SIZE):
+        img = _synthetic_image(width, height, rng)
+        for name in formats:
+            output = BytesIO()
+            img.save(output, **FORMATS[name][1])
+            pool[name].append(output.getvalue())
+    return pool
+
+
+def synthesize(collections_dir, collections, mix, width=1600, height=1200, seed=0):
+    """Populate collections_dir with synthetic collections.
+
+    collections maps collection name to photo count; mix maps format name
+    to its share of the photos. Returns a summary of what was written.
+    """
+    rng = random.Random(seed)
+    pool = build_pool(width, height, list(mix), seed)
+    names, weights = zip(*mix.items())
+
+    summary = {'collections': {}, 'total_photos': 0, 'total_bytes': 0}
+    for collection_name, count in collections.items():
+        collection_path = os.path.join(collections_dir, collection_name)
+        os.makedirs(collection_path, exist_ok=True)
+
+        counts = dict.fromkeys(names, 0)
+        for index in range(count):
+            fmt = rng.choices(names, weights)[0]
+            data = rng.choice(pool[fmt])
+            with open(os.path.join(collection_path, f'photo_{index:06d}{FORMATS[fmt][0]}'), 'wb') as out:
+                out.write(data)
+            counts[fmt] += 1
+            summary['total_bytes'] += len(data)
+
+        summary['collections'][collection_name] = {'photos': count, 'formats': counts}
+        summary['total_photos'] += count
+
+    return summary
+
+
+def sample_upload(width=1600, height=1200, seed=0):
+    """A JPEG to upload; callers append a unique suffix so dedupe doesn't skip it"""
+    output = BytesIO()
+    _synthetic_image(width, height, random.Random(seed)).save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def clear(collections_dir):
+    shutil.rmtree(collections_dir, ignore_errors=True)
@@ -0,0 +1,70 @@
+"""Run the scenarios against the Flask app in this process through its test client.
+
+Invoked by benchmarks.run in a fresh interpreter with COLLECTIONS_DIR,
+DATABASE_URL and RENDITION_CACHE_DIR pointing at the benchmark dataset;
+prints the results as JSON on stdout.
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from benchmarks.scenarios import build_scenarios
+from benchmarks.stats import TreeMonitor, summarize
+
+
+def main(config):
+    started = time.perf_counter()
+    import main as gallery  # noqa: E402 - the import reconciles the catalog
+    startup_s = time.perf_counter() - started
+
+    client = gallery.app.test_client()
+
+    def send(bench_request):
+        response = client.open(
+            bench_request.path, method=bench_request.method,
+            headers=bench_request.headers, data=bench_request.body,
+        )
+        # Drain streamed bodies (ZIP exports) like a real client would
+        body = b''.join(response.iter_encoded())
+        response.close()
+        return response.status_code, dict(response.headers), body
+
+    scenarios = build_scenarios(
+        send, config['collection'], config['zip_collection'],
+        bytes.fromhex(config['upload_hex']), config['run_id'], config['page_size'],
+    )
+
+    monitor = TreeMonitor(os.getpid())
+    results = []
+    for scenario in scenarios:
+        if config['scenarios'] and scenario.name not in config['scenarios']:
+            continue
+        count = min(config['requests'], scenario.max_requests or config['requests'])
+        latencies, errors, nbytes = [], 0, 0
+
+        monitor.start()
+        scenario_start = time.perf_counter()
+        for i in range(count):
+            bench_request = scenario.make_request(i)
+            request_start = time.perf_counter()
+            status, _, body = send(bench_request)
+            latencies.append(time.perf_counter() - request_start)
+            nbytes += len(body)
+            if status not in scenario.expected:
+                errors += 1
+        elapsed = time.perf_counter() - scenario_start
+        cpu = monitor.stop()
+
+        results.append(summarize(scenario.name, latencies, errors, elapsed, nbytes, cpu, monitor.peak_rss))
+        print(f'  in-process {scenario.name}: {results[-1]["throughput_rps"]} req/s', file=sys.stderr)
+
+    gallery.pregeneration.shutdown(wait=False)
+    return {'startup_s': round(startup_s, 3), 'concurrency': 1, 'scenarios': results}
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1]) as config_file:
+        print(json.dumps(main(json.load(config_file))))
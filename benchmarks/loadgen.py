@@ -0,0 +1,162 @@
+"""Run the scenarios against a local gunicorn server with concurrent clients."""
+import http.client
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.scenarios import build_scenarios
+from benchmarks.stats import TreeMonitor, summarize
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class GunicornServer:
+    """A gunicorn process serving the app on a free local port"""
+
+    def __init__(self, env, workers=2, extra_args='', startup_timeout=600):
+        self.env = env
+        self.workers = workers
+        self.extra_args = extra_args
+        self.startup_timeout = startup_timeout
+        self.port = free_port()
+        self.process = None
+        self.startup_s = None
+
+    def __enter__(self):
+        command = [
+            sys.executable, '-m', 'gunicorn', '--chdir', SRC_DIR,
+            '--bind', f'127.0.0.1:{self.port}', '--workers', str(self.workers),
+            '--timeout', '300', *shlex.split(self.extra_args), 'main:app',
+        ]
+        started = time.perf_counter()
+        self.process = subprocess.Popen(command, env=self.env, stdout=subprocess.DEVNULL)
+        self._wait_ready()
+        self.startup_s = time.perf_counter() - started
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with status {self.process.returncode}')
+            try:
+                status, _, _ = HttpClient('127.0.0.1', self.port).send_path('GET', '/api/collections')
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError('gunicorn did not become ready in time')
+
+
+class HttpClient:
+    """Keep-alive HTTP client; reconnects when the server closes the connection"""
+
+    def __init__(self, host, port, timeout=300):
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def send(self, bench_request):
+        return self.send_path(bench_request.method, bench_request.path, bench_request.headers, bench_request.body)
+
+    def send_path(self, method, path, headers=None, body=None):
+        try:
+            return self._send(method, path, headers, body)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # Sync workers close idle keep-alive connections; retry once on a new one
+            self.connection.close()
+            return self._send(method, path, headers, body)
+
+    def _send(self, method, path, headers, body):
+        self.connection.request(method, path, body=body, headers=headers or {})
+        response = self.connection.getresponse()
+        data = response.read()
+        return response.status, dict(response.getheaders()), data
+
+    def close(self):
+        self.connection.close()
+
+
+def run_scenario(port, scenario, requests, concurrency):
+    """Send requests across concurrency threads; returns (latencies, errors, bytes, elapsed)"""
+    count = min(requests, scenario.max_requests or requests)
+    next_index = iter(range(count))
+    index_lock = threading.Lock()
+    latencies, totals = [], {'errors': 0, 'bytes': 0}
+    results_lock = threading.Lock()
+
+    def worker():
+        client = HttpClient('127.0.0.1', port)
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                break
+            bench_request = scenario.make_request(i)
+            request_start = time.perf_counter()
+            try:
+                status, _, body = client.send(bench_request)
+            except (OSError, http.client.HTTPException):
+                status, body = None, b''
+                client.close()
+            latency = time.perf_counter() - request_start
+            with results_lock:
+                latencies.append(latency)
+                totals['bytes'] += len(body)
+                if status not in scenario.expected:
+                    totals['errors'] += 1
+        client.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, totals['errors'], totals['bytes'], time.perf_counter() - started
+
+
+def main(config, env):
+    with GunicornServer(env, config['workers'], config['gunicorn_args']) as server:
+        setup_client = HttpClient('127.0.0.1', server.port)
+        scenarios = build_scenarios(
+            setup_client.send, config['collection'], config['zip_collection'],
+            bytes.fromhex(config['upload_hex']), config['run_id'], config['page_size'],
+        )
+        setup_client.close()
+
+        monitor = TreeMonitor(server.process.pid)
+        results = []
+        for scenario in scenarios:
+            if config['scenarios'] and scenario.name not in config['scenarios']:
+                continue
+            monitor.start()
+            latencies, errors, nbytes, elapsed = run_scenario(
+                server.port, scenario, config['requests'], config['concurrency']
+            )
+            cpu = monitor.stop()
+            results.append(summarize(scenario.name, latencies, errors, elapsed, nbytes, cpu, monitor.peak_rss))
+            print(f'  gunicorn {scenario.name}: {results[-1]["throughput_rps"]} req/s', file=sys.stderr)
+
+        return {
+            'startup_s': round(server.startup_s, 3),
+            'workers': config['workers'],
+            'concurrency': config['concurrency'],
+            'scenarios': results,
+        }
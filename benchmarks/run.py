@@ -0,0 +1,193 @@
+"""Benchmark the gallery API hot paths.
+
+Synthesizes collections under a temporary COLLECTIONS_DIR, then drives the
+app through the Flask test client and/or a local gunicorn server and writes
+latency percentiles, throughput, CPU and peak RSS per endpoint as JSON.
+
+    python -m benchmarks.run --collections large=10000,small=50 --output before.json
+    python -m benchmarks.run --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from benchmarks import dataset, loadgen
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT, capture_output=True, text=True
+        ).stdout.strip()
+        return f'{revision}-dirty' if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def mode_environment(workdir, source_collections, mode, args):
+    """Give each mode its own copy of the dataset, catalog and rendition cache"""
+    mode_dir = os.path.join(workdir, mode)
+    collections_dir = os.path.join(mode_dir, 'collections')
+    # Hard links make the copy instant; uploads only ever add new files
+    shutil.copytree(source_collections, collections_dir, copy_function=os.link)
+
+    env = dict(os.environ)
+    env.update({
+        'COLLECTIONS_DIR': collections_dir,
+        'DATABASE_URL': f"sqlite:///{os.path.join(mode_dir, 'catalog.db')}",
+        'RENDITION_CACHE_DIR': os.path.join(mode_dir, 'renditions'),
+        'METRICS_DIR': os.path.join(mode_dir, 'metrics'),
+        'RENDITION_WORKERS': str(args.rendition_workers),
+    })
+    return env
+
+
+def run_inprocess(config, env, workdir):
+    config_path = os.path.join(workdir, 'inprocess.json')
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.inprocess', config_path],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.PIPE, check=True,
+    ).stdout
+    return json.loads(output)
+
+
+def run(args):
+    collections = dataset.parse_collections(args.collections)
+    mix = dataset.parse_mix(args.mix)
+    collection = args.collection or max(collections, key=collections.get)
+    zip_collection = args.zip_collection or min(collections, key=collections.get)
+
+    workdir = tempfile.mkdtemp(prefix='gallery-bench-')
+    try:
+        print(f'Synthesizing {sum(collections.values())} photos in {workdir}', file=sys.stderr)
+        started = time.perf_counter()
+        source_collections = os.path.join(workdir, 'source')
+        summary = dataset.synthesize(source_collections, collections, mix, args.width, args.height, args.seed)
+        summary['synthesize_s'] = round(time.perf_counter() - started, 3)
+
+        config = {
+            'collection': collection,
+            'zip_collection': zip_collection,
+            'upload_hex': dataset.sample_upload(args.width, args.height, args.seed).hex(),
+            'run_id': uuid.uuid4().hex[:8],
+            'page_size': args.page_size,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'gunicorn_args': args.gunicorn_args,
+            'scenarios': args.scenario,
+        }
+
+        report = {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': {key: value for key, value in config.items() if key != 'upload_hex'},
+            'dataset': summary,
+            'modes': {},
+        }
+
+        if args.mode in ('inprocess', 'both'):
+            print('Running in-process (Flask test client)', file=sys.stderr)
+            env = mode_environment(workdir, source_collections, 'inprocess', args)
+            report['modes']['inprocess'] = run_inprocess(config, env, workdir)
+
+        if args.mode in ('gunicorn', 'both'):
+            print(f'Running against gunicorn ({args.workers} workers, concurrency {args.concurrency})', file=sys.stderr)
+            env = mode_environment(workdir, source_collections, 'gunicorn', args)
+            report['modes']['gunicorn'] = loadgen.main(config, env)
+
+        return report
+    finally:
+        if args.keep:
+            print(f'Kept benchmark data in {workdir}', file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(before_path, after_path):
+    """Print per-scenario deltas between two reports"""
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print(f"before: {before.get('revision')}  after: {after.get('revision')}")
+
+    for mode, after_mode in after['modes'].items():
+        before_mode = before['modes'].get(mode)
+        if before_mode is None:
+            continue
+        print(f"\n{mode} (startup {before_mode['startup_s']}s -> {after_mode['startup_s']}s)")
+        print(f"{'scenario':<32}{'req/s':>22}{'p50 ms':>22}{'p99 ms':>22}{'peak RSS MB':>18}")
+        previous = {result['scenario']: result for result in before_mode['scenarios']}
+        for result in after_mode['scenarios']:
+            old = previous.get(result['scenario'])
+            if old is None:
+                continue
+            print(
+                f"{result['scenario']:<32}"
+                f"{_delta(old['throughput_rps'], result['throughput_rps']):>22}"
+                f"{_delta(old['latency_ms']['p50'], result['latency_ms']['p50']):>22}"
+                f"{_delta(old['latency_ms']['p99'], result['latency_ms']['p99']):>22}"
+                f"{_delta(old['peak_rss_mb'], result['peak_rss_mb']):>18}"
+            )
+
+
+def _delta(old, new):
+    if not old or new is None:
+        return f'{old} -> {new}'
+    return f'{old:g} -> {new:g} ({(new - old) / old:+.0%})'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--collections', default='large=10000,small=50',
+                        help='collection sizes as name=count pairs (default: %(default)s)')
+    parser.add_argument('--mix', default='jpeg=70,png=20,heic=10',
+                        help='format mix as format=weight pairs (default: %(default)s)')
+    parser.add_argument('--width', type=int, default=1600, help='synthetic photo width')
+    parser.add_argument('--height', type=int, default=1200, help='synthetic photo height')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--collection', help='collection used for listing and render scenarios (default: largest)')
+    parser.add_argument('--zip-collection', help='collection exported by the ZIP scenario (default: smallest)')
+    parser.add_argument('--mode', choices=['inprocess', 'gunicorn', 'both'], default='both')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients against gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--gunicorn-args', default='', help='extra gunicorn arguments, e.g. "--threads 4"')
+    parser.add_argument('--rendition-workers', type=int, default=1, help='background rendition processes')
+    parser.add_argument('--page-size', type=int, default=60)
+    parser.add_argument('--scenario', action='append', help='only run this scenario (repeatable)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary dataset')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two reports and exit')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import json
+import uuid
+from urllib.parse import quote, urlencode
+
+
+class BenchRequest:
+    """One HTTP request, in a form both the test client and the load generator can send"""
+
+    def __init__(self, method, path, headers=None, body=None):
+        self.method = method
+        self.path = path
+        self.headers = headers or {}
+        self.body = body
+
+
+class Scenario:
+    """A named endpoint workload.
+
+    make_request(i) returns the i-th request to send; expected lists the
+    status codes that count as success. max_requests caps scenarios that
+    only make sense once per item, like rendering each photo cold.
+    """
+
+    def __init__(self, name, make_request, expected=(200,), max_requests=None):
+        self.name = name
+        self.make_request = make_request
+        self.expected = expected
+        self.max_requests = max_requests
+
+
+def _json(response):
+    status, _, body = response
+    if status != 200:
+        raise RuntimeError(f'Setup request failed with HTTP {status}: {body[:200]!r}')
+    return json.loads(body)
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        )
+    for name, filename, data in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return f'multipart/form-data; boundary={boundary}', b''.join(parts)
+
+
+def build_scenarios(send, collection, zip_collection, upload_data, run_id, page_size=60):
+    """Discover the dataset through the API and return the scenarios to run.
+
+    send(BenchRequest) must return (status, headers, body). collection is
+    the large collection used for listing and rendering, zip_collection a
+    small one used for the ZIP export, and upload_data a JPEG that gets a
+    unique suffix per request so duplicate detection doesn't skip it.
+    """
+    base = f'/api/collections/{quote(collection)}/photos'
+
+    # Walk every page once, keeping each cursor for the deep-page scenario
+    photos, cursors, cursor = [], [None], None
+    while True:
+        params = {'limit': page_size}
+        if cursor:
+            params['cursor'] = cursor
+        page = _json(send(BenchRequest('GET', f'{base}?{urlencode(params)}')))
+        photos.extend(page['photos'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+        cursors.append(cursor)
+    if not photos:
+        raise RuntimeError(f'Collection "{collection}" has no photos')
+
+    warm_url = photos[0]['urls']['grid']
+    warm_status, warm_headers, _ = send(BenchRequest('GET', warm_url))
+    if warm_status != 200:
+        raise RuntimeError(f'Rendering {warm_url} failed with HTTP {warm_status}')
+    etag = warm_headers.get('ETag') or warm_headers.get('etag')
+
+    upload_collection = f'bench-uploads-{run_id}'
+    _json(send(BenchRequest(
+        'POST', '/api/admin/collections',
+        {'Content-Type': 'application/json'}, json.dumps({'name': upload_collection}).encode('utf-8'),
+    )))
+
+    def deep_page(i):
+        params = {'limit': page_size}
+        # Stride through the collection so later pages are hit as often as early ones
+        page_cursor = cursors[(i * 7919) % len(cursors)]
+        if page_cursor:
+            params['cursor'] = page_cursor
+        return BenchRequest('GET', f'{base}?{urlencode(params)}')
+
+    def upload(i):
+        content_type, body = _multipart(
+            {'collection': upload_collection},
+            [('files', f'upload_{i:06d}.jpg', upload_data + uuid.uuid4().bytes)],
+        )
+        return BenchRequest('POST', '/api/admin/upload', {'Content-Type': content_type}, body)
+
+    # Each cold render hits a different photo; the first one was rendered above
+    cold_urls = [photo['urls']['grid'] for photo in photos[1:]]
+    downloads = [photo['download_url'] for photo in photos]
+
+    return [
+        Scenario('collections', lambda i: BenchRequest('GET', '/api/collections')),
+        Scenario('collection_photos_first_page',
+                 lambda i: BenchRequest('GET', f'{base}?{urlencode({"limit": page_size})}')),
+        Scenario('collection_photos_deep_page', deep_page),
+        Scenario('photo_render_cold', lambda i: BenchRequest('GET', cold_urls[i]), max_requests=len(cold_urls)),
+        Scenario('photo_cached', lambda i: BenchRequest('GET', warm_url)),
+        Scenario('photo_not_modified',
+                 lambda i: BenchRequest('GET', warm_url, {'If-None-Match': etag}), expected=(304,)),
+        Scenario('photo_download', lambda i: BenchRequest('GET', downloads[i % len(downloads)])),
+        Scenario('collection_zip', lambda i: BenchRequest('GET', f'/api/collections/{quote(zip_collection)}/download.zip')),
+        # Last: each upload queues background rendering that would skew later scenarios
+        Scenario('upload_photos', upload),
+    ]
@@ -0,0 +1,115 @@
+import os
+import threading
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(name, latencies, errors, elapsed, nbytes, cpu_seconds, peak_rss_bytes):
+    """Build the JSON result for one scenario; latencies are in seconds"""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    latency_ms = {'mean': round(sum(ordered) / count * 1000, 3) if count else None}
+    for pct in PERCENTILES:
+        value = percentile(ordered, pct)
+        latency_ms[f'p{pct}'] = round(value * 1000, 3) if value is not None else None
+    latency_ms['max'] = round(ordered[-1] * 1000, 3) if count else None
+
+    return {
+        'scenario': name,
+        'requests': count,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(count / elapsed, 2) if elapsed > 0 else None,
+        'bytes_received': nbytes,
+        'latency_ms': latency_ms,
+        'cpu_s': round(cpu_seconds, 3),
+        'peak_rss_mb': round(peak_rss_bytes / (1024 * 1024), 1) if peak_rss_bytes else None,
+    }
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            return [int(child) for child in children.read().split()]
+    except OSError:
+        return []
+
+
+def process_tree(pid):
+    """pid and all of its descendants (Linux only; just pid elsewhere)"""
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        pending.extend(_children(current))
+    return pids
+
+
+def _proc_sample(pid):
+    """(rss bytes, cpu seconds) of one process from /proc, or None if it is gone"""
+    try:
+        with open(f'/proc/{pid}/stat') as stat_file:
+            # Fields after the parenthesised command name; utime/stime are 14/15, rss 24
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    return rss, cpu
+
+
+class TreeMonitor:
+    """Samples RSS and CPU of a process tree in the background.
+
+    Peak RSS is the largest sum over the tree seen at any sample; CPU is
+    summed per process between start() and stop(), so processes that exit
+    in between only count up to their last sample.
+    """
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._cpu_start = {}
+        self._cpu_last = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._cpu_start = self._cpu_last = {}
+        self._sample()
+        self._cpu_start = dict(self._cpu_last)
+        self.peak_rss = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return sum(cpu - self._cpu_start.get(pid, 0) for pid, cpu in self._cpu_last.items())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        total_rss, cpu_last = 0, dict(self._cpu_last)
+        for pid in process_tree(self.pid):
+            sample = _proc_sample(pid)
+            if sample is None:
+                continue
+            total_rss += sample[0]
+            cpu_last[pid] = sample[1]
+        self._cpu_last = cpu_last
+        self.peak_rss = max(self.peak_rss, total_rss)
@@ -0,0 +1,22 @@
+# Gunicorn settings for production: gunicorn -c gunicorn.conf.py --chdir src main:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Threaded workers: JSON listings, 304s and cached renditions keep being served
+# while a slow decode runs: image rendering is capped separately by
+# RENDER_THREADS / RENDER_QUEUE_LIMIT (see main.py) and Pillow releases the GIL
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 4)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# main.py sizes its render wait limit from this, to keep threads free for other routes
+os.environ['GUNICORN_THREADS'] = str(threads)
+
+# Long enough for a cold render of a large HEIC plus a ZIP export's first bytes;
+# gthread workers heartbeat independently of request duration
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
@@ -0,0 +1,493 @@
+import base64
+import binascii
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from src import filelock
+from src.imaging import make_placeholder, probe_image
+from src.models.photo import CatalogMeta, Collection, Photo
+from src.models.user import db
+
+# The catalog is derived from the files on disk, so instead of migrating it
+# we drop and rebuild its tables whenever this version changes.
+CATALOG_SCHEMA_VERSION = '7'
+CATALOG_TABLES = [Photo.__table__, Collection.__table__]
+
+# CatalogMeta key of the counter bumped whenever a collection summary changes;
+# it survives schema rebuilds so clients never see it go backwards
+VERSION_KEY = 'collections_version'
+
+# Sort keys accepted by page_photos(); prefix with '-' for descending order
+PHOTO_SORT_COLUMNS = {
+    'name': Photo.filename,
+    'uploaded': Photo.uploaded_at,
+    'taken': Photo.taken_at,
+}
+
+# Values of the orientation filter of page_photos(), by upright dimensions
+PHOTO_ORIENTATIONS = {
+    'landscape': Photo.width > Photo.height,
+    'portrait': Photo.width < Photo.height,
+    'square': Photo.width == Photo.height,
+}
+
+
+def source_version(size, mtime):
+    """Short token identifying one version of a source file, used in cache-busting URLs"""
+    return hashlib.sha1(f'{size}:{mtime!r}'.encode('utf-8')).hexdigest()[:12]
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file, read in fixed-size blocks"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _placeholder_or_blank(path):
+    """make_placeholder(path), or an empty placeholder and no hash if the file can't be decoded"""
+    try:
+        return make_placeholder(path)
+    except Exception:
+        return '', None
+
+
+def _encode_cursor(sort, value, photo_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, photo_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, photo_id = json.loads(raw)
+        if cursor_sort == sort and isinstance(PHOTO_SORT_COLUMNS[sort.lstrip('-')].type, db.DateTime):
+            value = datetime.fromisoformat(value)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort or not isinstance(photo_id, int):
+        raise ValueError('Cursor does not match the requested sort order')
+    return value, photo_id
+
+
+class Catalog:
+    """SQLite index of the collections and photos under COLLECTIONS_DIR.
+
+    The admin routes keep it updated as they change files; reconcile()
+    repairs drift from files that were added or removed behind our back.
+    All methods need an application context.
+    """
+
+    def __init__(self, collections_dir, is_image_file):
+        self.collections_dir = collections_dir
+        self.is_image_file = is_image_file
+
+    def startup(self):
+        """Create or rebuild the catalog tables and reconcile them with disk"""
+        # Serialize across gunicorn workers importing the app at the same time
+        with filelock.exclusive(self._lock_path()):
+            if db.engine.dialect.name == 'sqlite':
+                # Readers and the single writer no longer block each other;
+                # the setting is stored in the database file
+                with db.engine.connect() as connection:
+                    connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+            self.ensure_schema()
+            return self.reconcile()
+
+    def ensure_schema(self):
+        """Create the catalog tables, rebuilding them if the schema version changed"""
+        db.create_all()
+        if db.session.get(CatalogMeta, VERSION_KEY) is None:
+            db.session.add(CatalogMeta(key=VERSION_KEY, value='0'))
+            db.session.commit()
+
+        meta = db.session.get(CatalogMeta, 'schema_version')
+        if meta is not None and meta.value == CATALOG_SCHEMA_VERSION:
+            return False
+
+        db.metadata.drop_all(db.engine, tables=CATALOG_TABLES)
+        db.metadata.create_all(db.engine, tables=CATALOG_TABLES)
+        db.session.merge(CatalogMeta(key='schema_version', value=CATALOG_SCHEMA_VERSION))
+        self._bump_version()
+        db.session.commit()
+        return True
+
+    def version(self):
+        """Counter that changes whenever any collection summary changes"""
+        value = (
+            CatalogMeta.query.filter_by(key=VERSION_KEY)
+            .with_entities(CatalogMeta.value).scalar()
+        )
+        return int(value or 0)
+
+    def list_collections(self):
+        return Collection.query.order_by(Collection.name).all()
+
+    def page_photos(self, collection_name, sort='name', limit=60, cursor=None, camera=None,
+                    orientation=None, has_gps=None, taken_after=None, taken_before=None):
+        """Keyset-paginate the photos of a collection.
+
+        Ordering is by the sort column with the row id as a tie-breaker, so
+        pages stay stable while photos are added or removed. The optional
+        filters narrow the result; total counts the filtered photos. Returns
+        (photos, next_cursor, total); next_cursor is None on the last page.
+        Raises ValueError for an unknown sort, orientation or a malformed cursor.
+        """
+        if sort.lstrip('-') not in PHOTO_SORT_COLUMNS:
+            raise ValueError(f'Unknown sort "{sort}"')
+        if orientation is not None and orientation not in PHOTO_ORIENTATIONS:
+            raise ValueError(f'Unknown orientation "{orientation}"')
+        descending = sort.startswith('-')
+        column = PHOTO_SORT_COLUMNS[sort.lstrip('-')]
+        key = db.tuple_(column, Photo.id)
+
+        query = Photo.query.filter_by(collection=collection_name)
+        if camera is not None:
+            query = query.filter(Photo.camera == camera)
+        if orientation is not None:
+            query = query.filter(PHOTO_ORIENTATIONS[orientation])
+        if has_gps is not None:
+            query = query.filter(Photo.has_gps == has_gps)
+        if taken_after is not None:
+            query = query.filter(Photo.taken_at >= taken_after)
+        if taken_before is not None:
+            query = query.filter(Photo.taken_at < taken_before)
+        total = query.count()
+
+        if cursor:
+            value, photo_id = _decode_cursor(cursor, sort)
+            query = query.filter(key < (value, photo_id) if descending else key > (value, photo_id))
+
+        if descending:
+            query = query.order_by(column.desc(), Photo.id.desc())
+        else:
+            query = query.order_by(column, Photo.id)
+
+        photos = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(photos) > limit:
+            photos = photos[:limit]
+            last = photos[-1]
+            next_cursor = _encode_cursor(sort, getattr(last, column.key), last.id)
+
+        return photos, next_cursor, total
+
+    def list_cameras(self, collection_name):
+        """(camera, photo count) pairs of a collection, most photos first"""
+        return (
+            Photo.query.filter(Photo.collection == collection_name, Photo.camera.isnot(None))
+            .with_entities(Photo.camera, db.func.count(Photo.id).label('n'))
+            .group_by(Photo.camera)
+            .order_by(db.desc('n'), Photo.camera)
+            .all()
+        )
+
+    def list_filenames(self, collection_name):
+        """All photo filenames in a collection, in name order"""
+        rows = Photo.query.filter_by(collection=collection_name).order_by(Photo.filename).with_entities(Photo.filename)
+        return [filename for filename, in rows]
+
+    def list_perceptual_hashes(self):
+        """(collection, filename, perceptual hash) of every photo that has one"""
+        return (
+            Photo.query.filter(Photo.perceptual_hash.isnot(None))
+            .with_entities(Photo.collection, Photo.filename, Photo.perceptual_hash)
+            .all()
+        )
+
+    def get_photo(self, collection_name, filename):
+        return Photo.query.filter_by(collection=collection_name, filename=filename).first()
+
+    def add_collection(self, collection_name):
+        if db.session.get(Collection, collection_name) is None:
+            db.session.add(Collection(name=collection_name))
+            self._bump_version()
+        db.session.commit()
+
+    def remove_collection(self, collection_name):
+        Photo.query.filter_by(collection=collection_name).delete()
+        Collection.query.filter_by(name=collection_name).delete()
+        self._bump_version()
+        db.session.commit()
+
+    def index_photo(self, collection_name, filename, content_hash=None):
+        """Add or refresh a single photo after it was written to disk"""
+        return self._retry_on_conflict(self._index_photo, collection_name, filename, content_hash)
+
+    def _index_photo(self, collection_name, filename, content_hash):
+        path = os.path.join(self.collections_dir, collection_name, filename)
+        photo = self.get_photo(collection_name, filename)
+        if photo is None:
+            photo = Photo(collection=collection_name, filename=filename)
+            db.session.add(photo)
+        self._apply_stat(photo, path, os.stat(path))
+        if photo.format is not None:
+            # Uploads are checked for similar photos right away, so this one
+            # is not left to the background backfill
+            photo.placeholder, photo.perceptual_hash = _placeholder_or_blank(path)
+        photo.content_hash = content_hash
+        self._refresh_summary(collection_name)
+        self._bump_version()
+        db.session.commit()
+        return photo
+
+    def find_duplicate(self, collection_name, size, content_hash):
+        """Return the photo in a collection with identical contents, if any.
+
+        Only photos of the same size are candidates; their hashes are
+        computed on first use and stored, so each file is read at most once.
+        """
+        candidates = Photo.query.filter_by(collection=collection_name, size=size).all()
+        duplicate = None
+        for photo in candidates:
+            if photo.content_hash is None:
+                path = os.path.join(self.collections_dir, collection_name, photo.filename)
+                try:
+                    photo.content_hash = file_sha256(path)
+                except FileNotFoundError:
+                    continue
+            if photo.content_hash == content_hash:
+                duplicate = photo
+                break
+        db.session.commit()
+        return duplicate
+
+    def remove_photo(self, collection_name, filename):
+        Photo.query.filter_by(collection=collection_name, filename=filename).delete()
+        self._refresh_summary(collection_name)
+        self._bump_version()
+        db.session.commit()
+
+    def reconcile(self, collection_name=None):
+        """Bring the catalog in line with the files on disk.
+
+        Only files whose size or mtime changed are re-probed. Returns a dict
+        of added/updated/removed (collection, filename) pairs; a filename of
+        None means the whole collection was added or removed.
+        """
+        changes = {'added': [], 'updated': [], 'removed': []}
+
+        if collection_name is None:
+            on_disk = {
+                name for name in os.listdir(self.collections_dir)
+                if os.path.isdir(os.path.join(self.collections_dir, name))
+            } if os.path.isdir(self.collections_dir) else set()
+            for collection in Collection.query.all():
+                if collection.name not in on_disk:
+                    Photo.query.filter_by(collection=collection.name).delete()
+                    db.session.delete(collection)
+                    changes['removed'].append((collection.name, None))
+            if changes['removed']:
+                self._bump_version()
+            db.session.commit()
+        else:
+            on_disk = {collection_name}
+
+        # One transaction per collection, so progress survives a restart and
+        # the write lock is released between collections
+        for name in sorted(on_disk):
+            collection_changes = self._retry_on_conflict(self._reconcile_collection, name)
+            if any(collection_changes.values()):
+                self._bump_version()
+            db.session.commit()
+            for kind, items in collection_changes.items():
+                changes[kind].extend(items)
+        return changes
+
+    def backfill_placeholders(self, limit=100):
+        """Fill in the placeholder and perceptual hash of up to limit photos lacking them
+
+        reconcile() and sync_files() only read image headers, since decoding
+        every photo would hold up startup and the watcher; this is run in the
+        background afterwards. Files that fail to decode get an empty
+        placeholder and are not retried until they change. Returns the number
+        of photos updated.
+        """
+        rows = (
+            Photo.query.filter(Photo.placeholder.is_(None), Photo.format.isnot(None))
+            .order_by(Photo.id)
+            .with_entities(Photo.id, Photo.collection, Photo.filename, Photo.size, Photo.mtime)
+            .limit(limit)
+            .all()
+        )
+        # Decode outside any transaction so writers aren't held up meanwhile
+        db.session.commit()
+        results = [
+            (row, _placeholder_or_blank(os.path.join(self.collections_dir, row.collection, row.filename)))
+            for row in rows
+        ]
+
+        updated, collections = 0, set()
+        for row, (placeholder, perceptual_hash) in results:
+            # Skip photos that changed while we were decoding; they are picked up again
+            updated += Photo.query.filter_by(id=row.id, size=row.size, mtime=row.mtime).update(
+                {Photo.placeholder: placeholder, Photo.perceptual_hash: perceptual_hash},
+                synchronize_session=False
+            )
+            collections.add(row.collection)
+        if updated:
+            for collection_name in collections:
+                self._refresh_summary(collection_name)
+            self._bump_version()
+        db.session.commit()
+        return updated
+
+    def sync_files(self, collection_name, filenames):
+        """Re-check specific files of a collection, e.g. after filesystem events.
+
+        Cheaper than reconcile() for a large collection: only the named
+        files are stat-ed. Returns changes in the same shape as reconcile().
+        """
+        return self._retry_on_conflict(self._sync_files, collection_name, filenames)
+
+    def _sync_files(self, collection_name, filenames):
+        collection_path = os.path.join(self.collections_dir, collection_name)
+        if not os.path.isdir(collection_path):
+            return self.reconcile(collection_name)
+
+        changes = {'added': [], 'updated': [], 'removed': []}
+        filenames = [filename for filename in set(filenames) if self.is_image_file(filename)]
+        known = {
+            photo.filename: photo
+            for photo in Photo.query.filter(Photo.collection == collection_name, Photo.filename.in_(filenames))
+        }
+
+        for filename in filenames:
+            path = os.path.join(collection_path, filename)
+            photo = known.get(filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if photo is not None:
+                    db.session.delete(photo)
+                    changes['removed'].append((collection_name, filename))
+                continue
+            self._sync_stat(collection_name, filename, photo, path, stat, changes)
+
+        if any(changes.values()) or db.session.get(Collection, collection_name) is None:
+            self._refresh_summary(collection_name)
+            self._bump_version()
+        db.session.commit()
+        return changes
+
+    def _retry_on_conflict(self, method, *args):
+        # The watcher, uploads and other workers may index the same new file
+        # or collection at once; whoever loses the insert starts over and
+        # finds the row the winner committed
+        try:
+            return method(*args)
+        except IntegrityError:
+            db.session.rollback()
+            return method(*args)
+
+    def _reconcile_collection(self, collection_name):
+        changes = {'added': [], 'updated': [], 'removed': []}
+        collection_path = os.path.join(self.collections_dir, collection_name)
+        if not os.path.isdir(collection_path):
+            Photo.query.filter_by(collection=collection_name).delete()
+            Collection.query.filter_by(name=collection_name).delete()
+            changes['removed'].append((collection_name, None))
+            return changes
+
+        if db.session.get(Collection, collection_name) is None:
+            changes['added'].append((collection_name, None))
+        known = {photo.filename: photo for photo in Photo.query.filter_by(collection=collection_name)}
+
+        for filename in os.listdir(collection_path):
+            if not self.is_image_file(filename):
+                continue
+            path = os.path.join(collection_path, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+
+            self._sync_stat(collection_name, filename, known.pop(filename, None), path, stat, changes)
+
+        for filename, photo in known.items():
+            db.session.delete(photo)
+            changes['removed'].append((collection_name, filename))
+
+        db.session.flush()
+        self._refresh_summary(collection_name)
+        return changes
+
+    def _sync_stat(self, collection_name, filename, photo, path, stat, changes):
+        if photo is None:
+            photo = Photo(collection=collection_name, filename=filename)
+            db.session.add(photo)
+            changes['added'].append((collection_name, filename))
+        elif photo.size == stat.st_size and photo.mtime == stat.st_mtime:
+            return
+        else:
+            changes['updated'].append((collection_name, filename))
+        self._apply_stat(photo, path, stat)
+
+    def _bump_version(self):
+        # A single UPDATE, so concurrent workers can't lose an increment
+        CatalogMeta.query.filter_by(key=VERSION_KEY).update(
+            {CatalogMeta.value: db.cast(db.cast(CatalogMeta.value, db.Integer) + 1, db.String)},
+            synchronize_session=False
+        )
+
+    def _apply_stat(self, photo, path, stat):
+        if photo.size != stat.st_size or photo.mtime != stat.st_mtime:
+            # Recomputed by backfill_placeholders()
+            photo.content_hash = photo.placeholder = photo.perceptual_hash = None
+        photo.size = stat.st_size
+        photo.mtime = stat.st_mtime
+        photo.uploaded_at = datetime.utcfromtimestamp(stat.st_mtime)
+        try:
+            metadata = probe_image(path)
+            photo.width, photo.height, photo.format = metadata['width'], metadata['height'], metadata['format']
+            photo.taken_at = metadata['taken_at'] or photo.uploaded_at
+            photo.orientation, photo.camera = metadata['orientation'], metadata['camera']
+            photo.has_gps = metadata['has_gps']
+        except Exception:
+            # Still list files Pillow can't read, as the directory listing did
+            photo.width = photo.height = photo.format = photo.placeholder = photo.perceptual_hash = None
+            photo.orientation = photo.camera = None
+            photo.taken_at = photo.uploaded_at
+            photo.has_gps = False
+
+    def _refresh_summary(self, collection_name):
+        db.session.flush()
+        collection = db.session.get(Collection, collection_name)
+        if collection is None:
+            collection = Collection(name=collection_name)
+            db.session.add(collection)
+
+        photos = Photo.query.filter_by(collection=collection_name)
+        collection.photo_count = photos.count()
+        collection.total_bytes = photos.with_entities(db.func.coalesce(db.func.sum(Photo.size), 0)).scalar()
+
+        first = (
+            photos.order_by(Photo.filename)
+            .with_entities(Photo.filename, Photo.size, Photo.mtime, Photo.placeholder)
+            .first()
+        )
+        collection.preview_filename = first.filename if first else None
+        collection.preview_version = source_version(first.size, first.mtime) if first else None
+        collection.preview_placeholder = first.placeholder if first else None
+
+        dominant = (
+            photos.filter(Photo.format.isnot(None))
+            .with_entities(Photo.format, db.func.count(Photo.id).label('n'))
+            .group_by(Photo.format)
+            .order_by(db.desc('n'), Photo.format)
+            .first()
+        )
+        collection.dominant_format = dominant[0] if dominant else None
+
+    def _lock_path(self):
+        digest = hashlib.sha1(os.path.abspath(self.collections_dir).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(tempfile.gettempdir(), f'gallery-catalog-{digest}.lock')
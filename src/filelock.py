@@ -0,0 +1,58 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+
+def flock(lock_file, blocking=True):
+    """Take an exclusive lock on an open file, held until it is closed.
+
+    Returns False if blocking is off and another process holds the lock.
+    Where fcntl is unavailable this is a no-op that always succeeds.
+    """
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+@contextmanager
+def exclusive(path, remove=False):
+    """Hold an exclusive lock on the file at path for the duration of the block
+
+    The lock file's directory is created if needed. With remove=True the
+    lock file is deleted on release, so per-key lock files don't accumulate;
+    a waiter that locked the unlinked inode retries on the new file instead.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    while True:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock_file = open(path, 'a')
+        flock(lock_file)
+        if not remove:
+            break
+        try:
+            if os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+
+    try:
+        yield
+    finally:
+        if remove:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        lock_file.close()
@@ -0,0 +1,301 @@
+import base64
+import logging
+import os
+from datetime import datetime
+from io import BytesIO
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+import pillow_heif
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+# Register HEIF opener with Pillow
+pillow_heif.register_heif_opener()
+
+# Format each source extension is re-encoded to for display
+DISPLAY_FORMATS = {
+    '.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.gif': 'GIF',
+    '.bmp': 'BMP', '.webp': 'WEBP', '.heic': 'JPEG', '.heif': 'JPEG',
+}
+DISPLAY_QUALITY = 85
+
+# Encoder quality per output format; lossless formats ignore it
+FORMAT_QUALITY = {
+    'JPEG': DISPLAY_QUALITY,
+    'WEBP': 80,
+    'AVIF': 60,
+}
+FORMAT_MIMETYPES = {
+    'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif',
+    'BMP': 'image/bmp', 'WEBP': 'image/webp', 'AVIF': 'image/avif',
+}
+
+# Decode/reduce to at least this multiple of the target size before the final
+# LANCZOS pass; 2.0 is visually indistinguishable from a full-size resample
+REDUCING_GAP = 2.0
+
+# Modern formats offered to clients that explicitly accept them, best first
+NEGOTIABLE_FORMATS = ['AVIF', 'WEBP']
+
+# Named rendition presets (target width in pixels). Arbitrary ?w= requests are
+# snapped to one of these widths so the rendition cache stays bounded.
+RENDITION_PRESETS = {
+    'thumb': 256,
+    'grid': 512,
+    'view': 1280,
+    'full': 2048,
+}
+RENDITION_WIDTHS = sorted(RENDITION_PRESETS.values())
+DEFAULT_PRESET = 'view'
+
+# Low-quality image placeholders: a tiny image inlined in listings as a data
+# URI and stretched by the browser, which blurs it, until the real image loads
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+# Perceptual hashes (dHash): compare horizontally adjacent pixels of a
+# (HASH_SIZE + 1) x HASH_SIZE grayscale thumbnail, giving HASH_SIZE² bits
+HASH_SIZE = 8
+
+# EXIF orientations that rotate the image by 90 degrees, swapping its sides
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+EXIF_DATETIME_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+# Collection cover sprites: one tile per collection, stacked vertically, in
+# the 16:10 aspect of the collection cards
+COVER_TILE_SIZE = (400, 250)
+COVER_SPRITE_QUALITY = 75
+
+def display_format_for(filename):
+    """Get the output format used when displaying a source file"""
+    return DISPLAY_FORMATS.get(os.path.splitext(filename.lower())[1], 'JPEG')
+
+def quality_for(output_format):
+    """Encoder quality used for an output format"""
+    return FORMAT_QUALITY.get(output_format, DISPLAY_QUALITY)
+
+def available_formats():
+    """Negotiable formats this Pillow build can encode"""
+    Image.init()
+    return [fmt for fmt in NEGOTIABLE_FORMATS if fmt in Image.SAVE]
+
+def negotiate_format(accept_mimetypes, fallback_format):
+    """Pick the output format for a request from its Accept header.
+
+    Only formats the client names explicitly are chosen; wildcards like
+    image/* or */* get the fallback, since old browsers send them too.
+    """
+    accepted = {value.lower() for value, quality in accept_mimetypes if quality > 0}
+    for fmt in available_formats():
+        if FORMAT_MIMETYPES[fmt] in accepted:
+            return fmt
+    return fallback_format
+
+def snap_width(width):
+    """Snap a requested width to the smallest allowed rendition width that covers it"""
+    for allowed in RENDITION_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return RENDITION_WIDTHS[-1]
+
+def _encode(img, output_format, quality):
+    if output_format == 'JPEG' and img.mode not in ('RGB', 'L', 'CMYK'):
+        img = img.convert('RGB')
+    output = BytesIO()
+    with metrics.phase('encode', format=output_format):
+        img.save(output, format=output_format, quality=quality, optimize=True)
+    output.seek(0)
+    return output
+
+def _decode(img, max_width, max_height=None):
+    """Load an opened image's pixels, decoding as little of it as possible.
+
+    draft() must run before the pixels are loaded: it makes the JPEG decoder
+    use DCT scaling (1/2, 1/4 or 1/8), and makes pillow_heif (1.8 and later)
+    decode an embedded HEIF thumbnail instead of the full image when one is
+    big enough.
+    The result is turned upright according to its EXIF orientation, and the
+    bounds apply to the upright image.
+    """
+    source_format = img.format
+    orientation = _orientation(img.getexif())
+    width, height = img.size
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    scale = min(max_width / width, (max_height or height) / height)
+    if scale < 1:
+        # Pass the real target size: thumbnail() would draft to the bounding
+        # box, which is unbounded in height for width-only renditions
+        img.draft(None, (int(img.width * scale * REDUCING_GAP), int(img.height * scale * REDUCING_GAP)))
+    with metrics.phase('decode', format=source_format):
+        img.load()
+    if orientation != 1:
+        # Rotating the reduced decode is cheap next to decoding
+        img = ImageOps.exif_transpose(img)
+    return img
+
+def _downscale(img, max_width, max_height=None, source_format=None):
+    """Shrink a loaded image in place: an integer reduce, then a LANCZOS pass"""
+    with metrics.phase('resize', format=source_format or img.format):
+        img.thumbnail((max_width, max_height or img.height), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    return img
+
+def process_image_for_display(image_path, max_width=RENDITION_PRESETS[DEFAULT_PRESET], max_height=None,
+                              output_format=None, quality=DISPLAY_QUALITY):
+    """Process image for optimal display - resize and optimize
+
+    When max_height is None only the width is constrained, which is what
+    srcset width descriptors expect.
+    """
+    try:
+        with Image.open(image_path) as img:
+            source_format = img.format
+
+            # Calculate new size maintaining aspect ratio
+            img = _downscale(_decode(img, max_width, max_height), max_width, max_height, source_format)
+
+            # Convert HEIC to RGB if needed, after shrinking so it stays cheap
+            if source_format in ['HEIF', 'HEIC']:
+                img = img.convert('RGB')
+
+            format_to_save = output_format or ('JPEG' if source_format in ['HEIF', 'HEIC'] else source_format or 'JPEG')
+            return _encode(img, format_to_save, quality), format_to_save.lower()
+    except Exception:
+        logger.exception('Error processing image %s', image_path)
+        return None, None
+
+def render_renditions(image_path, targets):
+    """Decode a source once and encode a rendition for each (width, format) target
+
+    Widths are produced largest first, each downscaled from the previous
+    result. Returns a dict of (width, format) -> encoded bytes; errors
+    propagate.
+    """
+    renditions = {}
+    widths = sorted({width for width, _ in targets}, reverse=True)
+    with Image.open(image_path) as img:
+        source_format = img.format
+        is_heif = source_format in ['HEIF', 'HEIC']
+        img = _decode(img, widths[0])
+
+        for width in widths:
+            img = _downscale(img, width, source_format=source_format)
+            if is_heif and img.mode != 'RGB':
+                img = img.convert('RGB')
+            for target_width, output_format in targets:
+                if target_width == width:
+                    renditions[width, output_format] = _encode(
+                        img, output_format, quality_for(output_format)
+                    ).getvalue()
+
+    return renditions
+
+def difference_hash(gray):
+    """dHash of grayscale pixel arrays shaped (..., HASH_SIZE, HASH_SIZE + 1)
+
+    Vectorized over any leading dimensions, so a stack of thumbnails is
+    hashed in one call. Returns an int, or an array of uint64 for a stack.
+    """
+    gray = np.asarray(gray, dtype=np.int16)
+    bits = gray[..., 1:] > gray[..., :-1]
+    packed = np.packbits(bits.reshape(*bits.shape[:-2], HASH_SIZE * HASH_SIZE), axis=-1)
+    hashes = packed.view('>u8')[..., 0]
+    return int(hashes) if hashes.ndim == 0 else hashes.astype(np.uint64)
+
+def _hash_pixels(img):
+    thumbnail = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX)
+    return np.asarray(thumbnail)
+
+def make_placeholder(image_path):
+    """Encode a PLACEHOLDER_SIZE image of a source as a data URI, and its perceptual hash
+
+    Both come from the same reduced decode, so indexing a photo reads its
+    pixels once. Returns (data URI, dHash as a 16-digit hex string).
+    """
+    output_format = 'WEBP' if 'WEBP' in available_formats() else 'JPEG'
+    with Image.open(image_path) as img:
+        source_format = img.format
+        img = _decode(img, PLACEHOLDER_SIZE, PLACEHOLDER_SIZE)
+        perceptual_hash = f'{difference_hash(_hash_pixels(img)):016x}'
+        img = _downscale(img, PLACEHOLDER_SIZE, PLACEHOLDER_SIZE, source_format)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        data = _encode(img, output_format, PLACEHOLDER_QUALITY).getvalue()
+    return f'data:{FORMAT_MIMETYPES[output_format]};base64,{base64.b64encode(data).decode("ascii")}', perceptual_hash
+
+def render_cover_sprite(image_paths, tile_size=COVER_TILE_SIZE):
+    """Crop each source to a tile and stack the tiles vertically into one JPEG
+
+    Sources that can't be read leave a blank tile so the other offsets hold.
+    """
+    tile_width, tile_height = tile_size
+    sprite = Image.new('RGB', (tile_width, tile_height * len(image_paths)), (245, 245, 245))
+    for index, image_path in enumerate(image_paths):
+        try:
+            with Image.open(image_path) as img:
+                # draft() keeps both sides at least this big, which fit() needs to fill the tile
+                draft_size = (int(tile_width * REDUCING_GAP), int(tile_height * REDUCING_GAP))
+                if _orientation(img.getexif()) in TRANSPOSED_ORIENTATIONS:
+                    draft_size = draft_size[::-1]
+                img.draft('RGB', draft_size)
+                img = ImageOps.exif_transpose(img)
+                tile = ImageOps.fit(img.convert('RGB'), tile_size, Image.Resampling.LANCZOS)
+            sprite.paste(tile, (0, index * tile_height))
+        except Exception:
+            logger.exception('Error adding %s to the cover sprite', image_path)
+    return _encode(sprite, 'JPEG', COVER_SPRITE_QUALITY).getvalue()
+
+def _orientation(exif):
+    orientation = exif.get(ExifTags.Base.Orientation, 1)
+    return orientation if orientation in range(1, 9) else 1
+
+def _exif_text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return value.strip('\x00 ') if isinstance(value, str) else ''
+
+def _exif_datetime(value):
+    try:
+        return datetime.strptime(_exif_text(value)[:19], EXIF_DATETIME_FORMAT)
+    except ValueError:
+        return None
+
+def _camera(exif):
+    make = _exif_text(exif.get(ExifTags.Base.Make))
+    model = _exif_text(exif.get(ExifTags.Base.Model))
+    # Many vendors repeat the make in the model ("Canon" / "Canon EOS R5")
+    if make and model.lower().startswith(make.split()[0].lower()):
+        make = ''
+    return f'{make} {model}'.strip()[:255] or None
+
+def probe_image(image_path):
+    """Read dimensions, format and EXIF metadata from the image header without decoding pixels
+
+    Width and height are those of the upright image, after EXIF orientation.
+    Returns a dict with width, height, format, orientation, taken_at (naive
+    local capture time, or None), camera (or None) and has_gps.
+    """
+    with Image.open(image_path) as img:
+        exif = img.getexif()
+        orientation = _orientation(exif)
+        width, height = img.size
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+
+        exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+        taken_at = (
+            _exif_datetime(exif_ifd.get(ExifTags.Base.DateTimeOriginal))
+            or _exif_datetime(exif_ifd.get(ExifTags.Base.DateTimeDigitized))
+            or _exif_datetime(exif.get(ExifTags.Base.DateTime))
+        )
+        return {
+            'width': width,
+            'height': height,
+            'format': img.format,
+            'orientation': orientation,
+            'taken_at': taken_at,
+            'camera': _camera(exif),
+            'has_gps': bool(exif.get_ifd(ExifTags.IFD.GPSInfo)),
+        }
@@ -3,26 +3,118 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+import hashlib
+import json
+import logging
 import mimetypes
 import shutil
-from flask import Flask, jsonify, send_file, send_from_directory, request
-from flask_cors import CORS
-from PIL import Image
-import pillow_heif
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
 from io import BytesIO
+from urllib.parse import quote, urlencode
+from flask import Flask, Response, g, jsonify, send_file, send_from_directory, request
+from flask_cors import CORS
+import click
+from concurrent.futures import as_completed
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import secure_filename
+from src import metrics
+from src.catalog import Catalog, source_version
+from src.imaging import (
+    COVER_SPRITE_QUALITY, COVER_TILE_SIZE, DEFAULT_PRESET, DISPLAY_QUALITY, FORMAT_MIMETYPES, FORMAT_QUALITY,
+    RENDITION_PRESETS, RENDITION_WIDTHS,
+    display_format_for, negotiate_format, process_image_for_display, quality_for, render_cover_sprite, snap_width,
+)
+from src.pregenerate import PregenerationQueue
+from src.models.user import db
+from src.render_queue import RenderBusy, RenderQueue
+from src.rendition_cache import RENDITION_VERSION, RenditionCache
+from src.similarity import MultiIndexHash, duplicate_clusters
+from src.uploads import UPLOAD_PREFIX, ChunkedUploads, UploadError, place_unique, write_stream
+from src.watcher import FULL_RESCAN, CollectionWatcher
+from src.zipstream import ZipStream
 
-# Register HEIF opener with Pillow
-pillow_heif.register_heif_opener()
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO'),
+    format='%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'
+)
+logger = logging.getLogger('gallery')
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 CORS(app)
 
 # Configuration
-COLLECTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'collections')
+COLLECTIONS_DIR = os.environ.get(
+    'COLLECTIONS_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'collections')
+)
 SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif'}
 
+# Rendition cache configuration
+RENDITION_CACHE_DIR = os.environ.get(
+    'RENDITION_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'renditions')
+)
+RENDITION_CACHE_MAX_BYTES = int(os.environ.get('RENDITION_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Versioned URLs (?v=<source version>) never change content, so browsers and
+# CDNs may keep them for a year without revalidating
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+STATIC_VERSIONED_ASSETS = ('styles.css', 'script.js')
+
+# Collection covers beyond this many are left out of the sprite (its height is
+# capped by the JPEG format) and load individually
+COVER_SPRITE_MAX_TILES = 200
+
+# Photo listing page sizes
+DEFAULT_PAGE_SIZE = 60
+MAX_PAGE_SIZE = 500
+
+# Chunk size suggested to clients of the resumable upload API
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Number of processes used to pre-generate renditions in the background
+RENDITION_WORKERS = int(os.environ.get('RENDITION_WORKERS', os.cpu_count() or 1))
+
+# Requests slower than this many milliseconds are logged; unset disables the log
+SLOW_REQUEST_MS = float(os.environ['SLOW_REQUEST_MS']) if os.environ.get('SLOW_REQUEST_MS') else None
+
+# Watch COLLECTIONS_DIR for files copied in behind the app's back (e.g. rsync);
+# set WATCH_COLLECTIONS=0 to rely on manual reconciles instead
+WATCH_COLLECTIONS = os.environ.get('WATCH_COLLECTIONS', '1') != '0'
+WATCH_POLL_INTERVAL = float(os.environ.get('WATCH_POLL_INTERVAL', 2.0))
+
+# Request threads per gunicorn worker; gunicorn.conf.py exports its setting
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# On-demand renders per worker process: RENDER_THREADS run at once, and at
+# most RENDER_QUEUE_LIMIT request threads wait on renders (including requests
+# sharing a render already underway). Anything beyond gets a 503 with
+# Retry-After, so half of the worker's threads stay free for other routes.
+RENDER_THREADS = int(os.environ.get('RENDER_THREADS', os.cpu_count() or 1))
+RENDER_QUEUE_LIMIT = int(os.environ.get('RENDER_QUEUE_LIMIT', max(1, GUNICORN_THREADS // 2)))
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 30))
+RENDER_RETRY_AFTER = 2
+
+# Photos whose placeholder and perceptual hash are computed per background batch
+PLACEHOLDER_BACKFILL_BATCH = 50
+
+# Seconds a catalog write waits for another worker's transaction before failing
+SQLITE_BUSY_TIMEOUT = 30
+
+# Perceptual hashes differing in at most this many of their 64 bits count as
+# the same shot (resized, recompressed or lightly edited copies)
+DUPLICATE_DISTANCE = 6
+MAX_DUPLICATE_DISTANCE = 16
+
+rendition_cache = RenditionCache(RENDITION_CACHE_DIR, RENDITION_CACHE_MAX_BYTES)
+render_queue = RenderQueue(RENDER_THREADS, RENDER_QUEUE_LIMIT, RENDER_TIMEOUT, RENDER_RETRY_AFTER)
+pregeneration = PregenerationQueue(rendition_cache, RENDITION_WORKERS)
+chunked_uploads = ChunkedUploads(COLLECTIONS_DIR)
+
 def ensure_collections_dir():
     """Ensure collections directory exists"""
     if not os.path.exists(COLLECTIONS_DIR):
@@ -32,79 +124,464 @@ def is_image_file(filename):
     """Check if file is a supported image format"""
     return os.path.splitext(filename.lower())[1] in SUPPORTED_FORMATS
 
+def rendition_version(version):
+    """URL token for the renditions of one source version
+
+    Folds in everything else that changes rendition output, so a new
+    pipeline or quality setting gets new URLs instead of year-old cached ones.
+    """
+    pipeline = json.dumps([RENDITION_VERSION, sorted(FORMAT_QUALITY.items()), DISPLAY_QUALITY, version])
+    return hashlib.sha1(pipeline.encode('utf-8')).hexdigest()[:12]
+
+def photo_url(collection_name, filename, preset=None, version=None, width=None):
+    """Build the rendition URL for a photo, pinned to a source version when given"""
+    url = f"/api/photo/{quote(collection_name)}/{quote(filename)}"
+    params = {'size': preset, 'w': width, 'v': rendition_version(version) if version else None}
+    query = urlencode({key: value for key, value in params.items() if value is not None})
+    return f"{url}?{query}" if query else url
+
+def photo_srcset(collection_name, filename, version=None):
+    """Build a srcset attribute value covering every rendition width"""
+    return ', '.join(
+        f"{photo_url(collection_name, filename, version=version, width=width)} {width}w"
+        for width in RENDITION_WIDTHS
+    )
+
+def apply_cache_policy(response, versioned):
+    """Cache versioned URLs for a year; make everything else revalidate"""
+    response.cache_control.public = True
+    if versioned:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def not_modified_response(etag, last_modified, versioned, vary=None):
+    """Build a 304 response carrying the same validators as the full response"""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    if vary:
+        response.vary.add(vary)
+    return apply_cache_policy(response, versioned)
+
+def busy_response(error):
+    """503 telling the client when to retry a render the server has no room for"""
+    response = jsonify({'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    response.cache_control.no_store = True
+    return response
+
+def render_rendition(collection_name, filename, image_path, cache_key, width, output_format, quality):
+    """Render one rendition into the cache; runs on the render queue
+
+    Returns (cached path, None), or (None, encoded bytes) if the result
+    couldn't be cached, or (None, None) if the source couldn't be processed.
+    """
+    # Another worker process may be rendering the same key: wait, then reuse its result
+    with rendition_cache.lock(collection_name, filename, cache_key):
+        cached_path = rendition_cache.get(collection_name, filename, cache_key, output_format)
+        if cached_path:
+            return cached_path, None
+        
+        processed_image, _ = process_image_for_display(
+            image_path, max_width=width, output_format=output_format, quality=quality
+        )
+        if processed_image is None:
+            return None, None
+        
+        try:
+            return rendition_cache.put(
+                collection_name, filename, cache_key, output_format, processed_image.getvalue()
+            ), None
+        except OSError:
+            logger.exception('Error caching rendition of %s', image_path)
+            return None, processed_image.getvalue()
+
+def rendition_response(response, versioned):
+    """Apply caching headers to a negotiated rendition response"""
+    response.vary.add('Accept')
+    return apply_cache_policy(response, versioned)
+
+_collections_cache = {}
+
 def get_collections():
-    """Get all collections (folders) from the collections directory"""
-    ensure_collections_dir()
+    """Get all collections from the catalog"""
     collections = []
+    sprite_tiles = 0
     
-    for item in os.listdir(COLLECTIONS_DIR):
-        collection_path = os.path.join(COLLECTIONS_DIR, item)
-        if os.path.isdir(collection_path):
-            # Count photos in collection
-            photos = [f for f in os.listdir(collection_path) if is_image_file(f)]
-            
-            # Get preview image (first photo)
-            preview_url = None
-            if photos:
-                preview_url = f"/api/photo/{item}/{photos[0]}"
-            
-            collections.append({
-                'name': item,
-                'photo_count': len(photos),
-                'preview_url': preview_url
-            })
+    for collection in catalog.list_collections():
+        # Get preview image (first photo)
+        preview_url = None
+        preview_srcset = None
+        sprite_index = None
+        if collection.preview_filename:
+            preview_url = photo_url(
+                collection.name, collection.preview_filename, 'grid', collection.preview_version
+            )
+            preview_srcset = photo_srcset(
+                collection.name, collection.preview_filename, collection.preview_version
+            )
+            if sprite_tiles < COVER_SPRITE_MAX_TILES:
+                sprite_index = sprite_tiles
+                sprite_tiles += 1
+        
+        collections.append({
+            'name': collection.name,
+            'photo_count': collection.photo_count,
+            'preview_url': preview_url,
+            'preview_srcset': preview_srcset,
+            'preview_placeholder': collection.preview_placeholder,
+            'sprite_index': sprite_index
+        })
     
     return collections
 
-def get_collection_photos(collection_name):
-    """Get all photos from a specific collection"""
-    collection_path = os.path.join(COLLECTIONS_DIR, collection_name)
+def cover_sprite_sources():
+    """The collections in the cover sprite, in tile order, and a key for that exact content"""
+    covers = [
+        (collection.name, collection.preview_filename, collection.preview_version)
+        for collection in catalog.list_collections()
+        if collection.preview_filename
+    ][:COVER_SPRITE_MAX_TILES]
+    key = hashlib.sha256(
+        json.dumps([RENDITION_VERSION, COVER_TILE_SIZE, COVER_SPRITE_QUALITY, covers]).encode('utf-8')
+    ).hexdigest()
+    return covers, key
+
+def serialize_photo(photo):
+    """Build the API representation of a catalog photo"""
+    collection_name, filename = photo.collection, photo.filename
+    version = source_version(photo.size, photo.mtime)
+    return {
+        'filename': filename,
+        'url': photo_url(collection_name, filename, version=version),
+        'urls': {preset: photo_url(collection_name, filename, preset, version) for preset in RENDITION_PRESETS},
+        'srcset': photo_srcset(collection_name, filename, version),
+        'download_url': f"{photo_url(collection_name, filename)}/download?{urlencode({'v': version})}",
+        'collection': collection_name,
+        'width': photo.width,
+        'height': photo.height,
+        'placeholder': photo.placeholder,
+        'taken_at': photo.taken_at.isoformat() if photo.taken_at else None,
+        'camera': photo.camera,
+        'has_gps': photo.has_gps
+    }
+
+def parse_photo_filters(args):
+    """Catalog filters from query parameters; raises ValueError for malformed values"""
+    filters = {}
+    for name in ('camera', 'orientation'):
+        if args.get(name):
+            filters[name] = args[name]
+    
+    if args.get('has_gps'):
+        if args['has_gps'] not in ('true', 'false'):
+            raise ValueError('has_gps must be "true" or "false"')
+        filters['has_gps'] = args['has_gps'] == 'true'
     
-    if not os.path.exists(collection_path) or not os.path.isdir(collection_path):
+    for name in ('taken_after', 'taken_before'):
+        if args.get(name):
+            try:
+                filters[name] = datetime.fromisoformat(args[name])
+            except ValueError:
+                raise ValueError(f'{name} must be an ISO 8601 date or date and time')
+    return filters
+
+def get_collection_photos(collection_name, sort='name', limit=DEFAULT_PAGE_SIZE, cursor=None, **filters):
+    """Get one page of photos of a specific collection from the catalog"""
+    photos, next_cursor, total = catalog.page_photos(
+        collection_name, sort=sort, limit=limit, cursor=cursor, **filters
+    )
+    return [serialize_photo(photo) for photo in photos], next_cursor, total
+
+_similarity_cache = {}
+_similarity_lock = threading.Lock()
+
+def similarity_index():
+    """Multi-index of every photo's perceptual hash, rebuilt when the catalog version changes
+
+    Returns (catalog version, index).
+    """
+    version = catalog.version()
+    cached = _similarity_cache.get('index')
+    if cached is None or cached[0] != version:
+        # One exact block lookup per query at the default distance
+        index = MultiIndexHash(blocks=DUPLICATE_DISTANCE + 1)
+        for collection_name, filename, perceptual_hash in catalog.list_perceptual_hashes():
+            index.add(int(perceptual_hash, 16), (collection_name, filename))
+        cached = _similarity_cache['index'] = (version, index)
+    return cached
+
+def add_to_similarity_index(photo, version_before):
+    """Add a just-indexed photo to the cached index instead of rebuilding it
+
+    Only safe when the index reflects version_before and this photo's
+    catalog update was the only change since; otherwise the next lookup
+    rebuilds from the catalog.
+    """
+    if photo.perceptual_hash is None:
+        return
+    with _similarity_lock:
+        cached = _similarity_cache.get('index')
+        version_after = catalog.version()
+        if cached is not None and cached[0] == version_before and version_after == version_before + 1:
+            cached[1].add(int(photo.perceptual_hash, 16), (photo.collection, photo.filename))
+            _similarity_cache['index'] = (version_after, cached[1])
+
+def find_similar(photo, distance=DUPLICATE_DISTANCE):
+    """Other photos, in any collection, that look like this one"""
+    if photo.perceptual_hash is None:
         return []
+    return [
+        {'collection': collection_name, 'filename': filename, 'distance': match_distance}
+        for match_distance, (collection_name, filename)
+        in similarity_index()[1].search(int(photo.perceptual_hash, 16), distance)
+        if (collection_name, filename) != (photo.collection, photo.filename)
+    ]
+
+def store_upload(collection_name, filename, tmp_path, content_hash):
+    """Move a fully received upload into its collection unless it is a duplicate
+
+    Returns (stored filename, None, similar photos) or (None, filename of the
+    existing copy, []). Near-duplicates are only reported; the upload is kept.
+    """
+    duplicate = catalog.find_duplicate(collection_name, os.path.getsize(tmp_path), content_hash)
+    if duplicate is not None:
+        os.remove(tmp_path)
+        return None, duplicate.filename, []
     
-    photos = []
-    for filename in os.listdir(collection_path):
-        if is_image_file(filename):
-            photos.append({
-                'filename': filename,
-                'url': f"/api/photo/{collection_name}/{filename}",
-                'collection': collection_name
-            })
+    collection_path = os.path.join(COLLECTIONS_DIR, collection_name)
+    filename = place_unique(tmp_path, collection_path, filename)
+    version_before, _ = similarity_index()
+    photo = catalog.index_photo(collection_name, filename, content_hash=content_hash)
+    add_to_similarity_index(photo, version_before)
+    rendition_cache.invalidate(collection_name, filename)
     
-    return photos
+    # Render presets in the background so the first visitor hits the cache
+    pregeneration.submit(collection_name, filename, os.path.join(collection_path, filename))
+    return filename, None, find_similar(photo)
 
-def process_image_for_display(image_path, max_width=800, max_height=600):
-    """Process image for optimal display - resize and optimize"""
-    try:
-        with Image.open(image_path) as img:
-            # Convert HEIC to RGB if needed
-            if img.format in ['HEIF', 'HEIC']:
-                img = img.convert('RGB')
-            
-            # Calculate new size maintaining aspect ratio
-            img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-            
-            # Save to BytesIO
-            output = BytesIO()
-            format_to_save = 'JPEG' if img.format in ['HEIF', 'HEIC'] else img.format or 'JPEG'
-            img.save(output, format=format_to_save, quality=85, optimize=True)
-            output.seek(0)
+def upload_error_response(error):
+    """JSON response for an UploadError"""
+    return jsonify({
+        'success': False,
+        'message': str(error),
+        **error.details
+    }), error.status
+
+def reconcile_catalog(collection_name=None):
+    """Repair catalog drift and drop renditions of files that changed on disk"""
+    changes = catalog.reconcile(collection_name)
+    for name, filename in changes['updated'] + changes['removed']:
+        rendition_cache.invalidate(name, filename)
+    return changes
+
+def apply_collection_changes(changes):
+    """Bring the catalog and caches up to date with changes seen by the watcher"""
+    with app.app_context():
+        for collection_name, filenames in changes.items():
+            if filenames is FULL_RESCAN:
+                result = reconcile_catalog(collection_name)
+            else:
+                result = catalog.sync_files(collection_name, filenames)
+                for name, filename in result['updated'] + result['removed']:
+                    rendition_cache.invalidate(name, filename)
             
-            return output, format_to_save.lower()
-    except Exception as e:
-        print(f"Error processing image {image_path}: {e}")
-        return None, None
+            if any(result.values()):
+                logger.info(
+                    'Collection %s changed on disk: %d added, %d updated, %d removed', collection_name,
+                    len(result['added']), len(result['updated']), len(result['removed'])
+                )
+            for name, filename in result['removed']:
+                pregeneration.forget(name, filename)
+            # Render new and replaced photos before anyone asks for them
+            for name, filename in result['added'] + result['updated']:
+                if filename is not None:
+                    pregeneration.submit(name, filename, os.path.join(COLLECTIONS_DIR, name, filename))
+    request_placeholder_backfill()
+
+_backfill_wakeup = threading.Event()
+_backfill_thread = None
+_backfill_lock = threading.Lock()
+
+def request_placeholder_backfill():
+    """Have a background thread compute placeholders and perceptual hashes the catalog lacks"""
+    global _backfill_thread
+    with _backfill_lock:
+        if _backfill_thread is None:
+            _backfill_thread = threading.Thread(target=run_placeholder_backfill, name='placeholder-backfill', daemon=True)
+            _backfill_thread.start()
+    _backfill_wakeup.set()
+
+def run_placeholder_backfill():
+    while True:
+        _backfill_wakeup.wait()
+        _backfill_wakeup.clear()
+        try:
+            with app.app_context():
+                # Small batches keep each write transaction short
+                while catalog.backfill_placeholders(PLACEHOLDER_BACKFILL_BATCH):
+                    pass
+        except Exception:
+            logger.exception('Error computing photo placeholders')
+
+collection_watcher = CollectionWatcher(COLLECTIONS_DIR, apply_collection_changes, WATCH_POLL_INTERVAL)
+
+def iter_photo_files(collection_name=None):
+    """Yield (collection, filename, path) for every photo, optionally in one collection"""
+    ensure_collections_dir()
+    collection_names = [collection_name] if collection_name else sorted(os.listdir(COLLECTIONS_DIR))
+    
+    for name in collection_names:
+        collection_path = os.path.join(COLLECTIONS_DIR, name)
+        if not os.path.isdir(collection_path):
+            continue
+        for filename in sorted(os.listdir(collection_path)):
+            if is_image_file(filename):
+                yield name, filename, os.path.join(collection_path, filename)
+
+# Database and photo catalog; the default lives next to the rendition cache,
+# outside version control, since it is rebuilt from COLLECTIONS_DIR on startup
+CATALOG_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'catalog.db')
+if 'DATABASE_URL' not in os.environ:
+    os.makedirs(os.path.dirname(CATALOG_DB_PATH), exist_ok=True)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f"sqlite:///{CATALOG_DB_PATH}")
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # Workers take turns writing; wait for the lock rather than fail with "database is locked"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT}}
+db.init_app(app)
+
+catalog = Catalog(COLLECTIONS_DIR, is_image_file)
+with app.app_context():
+    ensure_collections_dir()
+    catalog.startup()
+
+# Request instrumentation
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def start_collection_watcher():
+    # Started on the first request rather than at import, so CLI commands don't
+    # spawn it; only one process per deployment actually watches
+    if WATCH_COLLECTIONS:
+        collection_watcher.start()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count and time every request; log slow ones when SLOW_REQUEST_MS is set"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    # The route pattern, not the URL, so label cardinality stays bounded
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    nbytes = response.content_length or 0
+
+    metrics.inc('gallery_http_requests_total', route=route, method=request.method, status=response.status_code)
+    metrics.inc('gallery_http_response_bytes_total', nbytes, route=route)
+    metrics.observe('gallery_http_request_duration_seconds', elapsed, route=route)
+
+    if SLOW_REQUEST_MS is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+        image = g.get('image')
+        logger.warning(
+            'Slow request: %s %s -> %s in %.1f ms, %d bytes%s',
+            request.method, request.full_path.rstrip('?'), response.status_code, elapsed * 1000, nbytes,
+            f", source {image['source']} -> {image['width']}w {image['format']} (cache {image['cache']})" if image else ''
+        )
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request and image pipeline metrics, summed over all worker processes"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 # API Routes
 @app.route('/api/collections')
 def api_collections():
     """API endpoint to get all collections"""
     try:
-        collections = get_collections()
+        # The listing only changes when the catalog version does, so it is
+        # rendered once per version and served from memory until then
+        version = catalog.version()
+        cached = _collections_cache.get('listing')
+        if cached is None or cached[0] != version:
+            collections = get_collections()
+            covers, sprite_key = cover_sprite_sources()
+            body = json.dumps({
+                'success': True,
+                'version': version,
+                'collections': collections,
+                'cover_sprite': {
+                    'url': f"/api/collections/covers.jpg?{urlencode({'v': sprite_key[:16]})}",
+                    'tiles': len(covers)
+                } if covers else None
+            })
+            cached = _collections_cache['listing'] = (version, body)
+        
+        response = app.response_class(cached[1], mimetype='application/json')
+        response.set_etag(f'collections-{version}')
+        apply_cache_policy(response, versioned=False)
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+def render_cover_sprite_cached(covers, sprite_key):
+    """Render the cover sprite into the cache and return its path; runs on the render queue"""
+    with rendition_cache.lock('', 'covers', sprite_key):
+        cached_path = rendition_cache.get('', 'covers', sprite_key, 'JPEG')
+        if cached_path:
+            return cached_path
+        sprite = render_cover_sprite([
+            os.path.join(COLLECTIONS_DIR, collection_name, filename)
+            for collection_name, filename, _ in covers
+        ])
+        return rendition_cache.put('', 'covers', sprite_key, 'JPEG', sprite)
+
+@app.route('/api/collections/covers.jpg')
+def api_collection_covers():
+    """Every collection cover in one sprite, so the landing page needs a single image request"""
+    try:
+        covers, sprite_key = cover_sprite_sources()
+        if not covers:
+            return jsonify({'error': 'No collection covers'}), 404
+        
+        etag = sprite_key[:32]
+        versioned = request.args.get('v') == sprite_key[:16]
+        if not is_resource_modified(request.environ, etag=etag):
+            return not_modified_response(etag, None, versioned)
+        
+        # Stored alongside the renditions, keyed by the exact set of covers
+        cached_path = rendition_cache.get('', 'covers', sprite_key, 'JPEG')
+        if cached_path is None:
+            try:
+                cached_path = render_queue.run(sprite_key, render_cover_sprite_cached, covers, sprite_key)
+            except RenderBusy as e:
+                return busy_response(e)
+        
+        return apply_cache_policy(send_file(
+            cached_path, mimetype='image/jpeg', etag=etag
+        ), versioned)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/collections/version')
+def api_collections_version():
+    """Current catalog version, for clients polling for changes"""
+    try:
         return jsonify({
             'success': True,
-            'collections': collections
+            'version': catalog.version()
         })
     except Exception as e:
         return jsonify({
@@ -114,14 +591,43 @@ def api_collections():
 
 @app.route('/api/collections/<collection_name>/photos')
 def api_collection_photos(collection_name):
-    """API endpoint to get photos from a specific collection"""
+    """API endpoint to get one page of photos from a specific collection"""
     try:
-        photos = get_collection_photos(collection_name)
-        return jsonify({
+        limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        
+        cursor = request.args.get('cursor')
+        
+        # Sorting and filtering are answered from the catalog's metadata
+        # columns, so no photo is opened to serve a page
+        try:
+            photos, next_cursor, total = get_collection_photos(
+                collection_name,
+                sort=request.args.get('sort', 'name'),
+                limit=limit,
+                cursor=cursor,
+                **parse_photo_filters(request.args)
+            )
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        result = {
             'success': True,
             'photos': photos,
-            'collection_name': collection_name
-        })
+            'collection_name': collection_name,
+            'total': total,
+            'next_cursor': next_cursor
+        }
+        if not cursor:
+            # Values for the camera filter, sent with the first page only
+            result['cameras'] = [
+                {'camera': camera, 'count': count}
+                for camera, count in catalog.list_cameras(collection_name)
+            ]
+        return jsonify(result)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -137,22 +643,79 @@ def api_photo(collection_name, filename):
         if not os.path.exists(image_path):
             return jsonify({'error': 'Photo not found'}), 404
         
-        # Process image for optimal display
-        processed_image, format_type = process_image_for_display(image_path)
+        # Resolve the requested rendition width
+        preset = request.args.get('size')
+        requested_width = request.args.get('w', type=int)
+        if preset is not None:
+            if preset not in RENDITION_PRESETS:
+                return jsonify({'error': f'Unknown size "{preset}"'}), 400
+            width = RENDITION_PRESETS[preset]
+        elif requested_width is not None and requested_width > 0:
+            width = snap_width(requested_width)
+        else:
+            width = RENDITION_PRESETS[DEFAULT_PRESET]
         
-        if processed_image is None:
+        source_stat = os.stat(image_path)
+        last_modified = datetime.fromtimestamp(source_stat.st_mtime, timezone.utc)
+        version = rendition_version(source_version(source_stat.st_size, source_stat.st_mtime))
+        versioned = request.args.get('v') == version
+        output_format = negotiate_format(request.accept_mimetypes, display_format_for(filename))
+        quality = quality_for(output_format)
+        mime_type = FORMAT_MIMETYPES[output_format]
+        cache_key = rendition_cache.key(
+            collection_name, filename, source_stat,
+            width, None, quality, output_format
+        )
+        
+        # The cache key already identifies source version and rendition
+        # parameters, so it doubles as a strong ETag
+        etag = cache_key[:32]
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            return not_modified_response(etag, last_modified, versioned, vary='Accept')
+        
+        # Serve straight from the rendition cache when this version was already encoded
+        cached_path = rendition_cache.get(collection_name, filename, cache_key, output_format)
+        metrics.inc('gallery_rendition_cache_total', result='hit' if cached_path else 'miss')
+        if SLOW_REQUEST_MS is not None:
+            # Image details for the slow-request log; skip the lookup when it's off
+            photo = catalog.get_photo(collection_name, filename)
+            g.image = {
+                'source': f'{photo.width}x{photo.height} {photo.format}' if photo else 'uncatalogued',
+                'width': width, 'format': output_format, 'cache': 'hit' if cached_path else 'miss',
+            }
+        if cached_path:
+            return rendition_response(send_file(
+                cached_path, mimetype=mime_type, download_name=filename,
+                etag=etag, last_modified=last_modified
+            ), versioned)
+        
+        # Render on the bounded queue; identical concurrent requests share one job
+        try:
+            cached_path, data = render_queue.run(
+                cache_key, render_rendition,
+                collection_name, filename, image_path, cache_key, width, output_format, quality
+            )
+        except RenderBusy as e:
+            return busy_response(e)
+        
+        if cached_path:
+            return rendition_response(send_file(
+                cached_path, mimetype=mime_type, download_name=filename,
+                etag=etag, last_modified=last_modified
+            ), versioned)
+        
+        if data is None:
             # Fallback to original file if processing fails
             return send_file(image_path)
         
-        # Determine MIME type
-        mime_type = f'image/{format_type}'
-        
-        return send_file(
-            processed_image,
+        return rendition_response(send_file(
+            BytesIO(data),
             mimetype=mime_type,
             as_attachment=False,
-            download_name=filename
-        )
+            download_name=filename,
+            etag=etag,
+            last_modified=last_modified
+        ), versioned)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -166,15 +729,57 @@ def api_photo_download(collection_name, filename):
         if not os.path.exists(image_path):
             return jsonify({'error': 'Photo not found'}), 404
         
-        return send_file(
+        source_stat = os.stat(image_path)
+        version = source_version(source_stat.st_size, source_stat.st_mtime)
+        
+        return apply_cache_policy(send_file(
             image_path,
             as_attachment=True,
-            download_name=filename
-        )
+            download_name=filename,
+            etag=f'original-{version}',
+            last_modified=datetime.fromtimestamp(source_stat.st_mtime, timezone.utc)
+        ), request.args.get('v') == version)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/collections/<collection_name>/download.zip', methods=['GET', 'POST'])
+def api_collection_download(collection_name):
+    """Stream a collection's originals, or a selection of them, as one ZIP"""
+    try:
+        collection_path = os.path.join(COLLECTIONS_DIR, collection_name)
+        if not os.path.isdir(collection_path):
+            return jsonify({'error': 'Collection not found'}), 404
+
+        filenames = catalog.list_filenames(collection_name)
+
+        # Optional subset: ?file=a.jpg&file=b.jpg, or a JSON body for long selections
+        selected = request.args.getlist('file')
+        if not selected and request.method == 'POST':
+            selected = (request.get_json(silent=True) or {}).get('filenames') or []
+        if selected:
+            selected = set(selected)
+            missing = selected.difference(filenames)
+            if missing:
+                return jsonify({'error': f'Photos not found: {", ".join(sorted(missing))}'}), 404
+            filenames = [filename for filename in filenames if filename in selected]
+
+        # Stored, not deflated: photos are already compressed, and fixed sizes
+        # let us send Content-Length so browsers can show progress
+        archive = ZipStream.from_paths(
+            (os.path.join(collection_path, filename), f'{collection_name}/{filename}')
+            for filename in filenames
+        )
+
+        response = Response(iter(archive), mimetype='application/zip', direct_passthrough=True)
+        response.content_length = len(archive)
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(collection_name)}.zip"
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Admin API Routes
 @app.route('/api/admin/login', methods=['POST'])
 def admin_login():
@@ -224,6 +829,7 @@ def create_collection():
             }), 400
         
         os.makedirs(collection_path)
+        catalog.add_collection(collection_name)
         
         return jsonify({
             'success': True,
@@ -250,6 +856,9 @@ def delete_collection(collection_name):
             }), 404
         
         shutil.rmtree(collection_path)
+        catalog.remove_collection(collection_name)
+        pregeneration.forget(collection_name)
+        rendition_cache.invalidate(collection_name)
         
         return jsonify({
             'success': True,
@@ -288,6 +897,8 @@ def upload_photos():
         
         files = request.files.getlist('files')
         uploaded_files = []
+        duplicates = []
+        similar = []
         errors = []
         
         for file in files:
@@ -297,16 +908,23 @@ def upload_photos():
             if file and is_image_file(file.filename):
                 try:
                     filename = secure_filename(file.filename)
-                    # Ensure unique filename
-                    counter = 1
-                    base_name, ext = os.path.splitext(filename)
-                    while os.path.exists(os.path.join(collection_path, filename)):
-                        filename = f"{base_name}_{counter}{ext}"
-                        counter += 1
                     
-                    file_path = os.path.join(collection_path, filename)
-                    file.save(file_path)
-                    uploaded_files.append(filename)
+                    # Hash while copying so duplicates are caught without a second read
+                    fd, tmp_path = tempfile.mkstemp(dir=collection_path, prefix=UPLOAD_PREFIX, suffix='.part')
+                    hasher = hashlib.sha256()
+                    with os.fdopen(fd, 'wb') as tmp_file:
+                        write_stream(file.stream, tmp_file, hasher)
+                    os.chmod(tmp_path, 0o644)
+                    
+                    stored, duplicate_of, similar_to = store_upload(
+                        collection_name, filename, tmp_path, hasher.hexdigest()
+                    )
+                    if stored:
+                        uploaded_files.append(stored)
+                        if similar_to:
+                            similar.append({'filename': stored, 'similar_to': similar_to})
+                    else:
+                        duplicates.append({'filename': file.filename, 'duplicate_of': duplicate_of})
                 except Exception as e:
                     errors.append(f"Failed to upload {file.filename}: {str(e)}")
             else:
@@ -316,6 +934,8 @@ def upload_photos():
             'success': True,
             'message': f'Uploaded {len(uploaded_files)} file(s) successfully',
             'uploaded_files': uploaded_files,
+            'duplicates': duplicates,
+            'similar': similar,
             'errors': errors
         })
         
@@ -325,6 +945,143 @@ def upload_photos():
             'message': str(e)
         }), 500
 
+@app.route('/api/admin/uploads', methods=['POST'])
+def init_upload():
+    """Start, or resume, a chunked upload of one file"""
+    try:
+        data = request.get_json(silent=True) or {}
+        collection_name = data.get('collection')
+        filename = secure_filename(data.get('filename') or '')
+        size = data.get('size')
+        
+        if not collection_name:
+            return jsonify({
+                'success': False,
+                'message': 'Collection name is required'
+            }), 400
+        
+        if not filename or not is_image_file(filename):
+            return jsonify({
+                'success': False,
+                'message': f'Invalid file type: {data.get("filename")}'
+            }), 400
+        
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            return jsonify({
+                'success': False,
+                'message': 'File size is required'
+            }), 400
+        
+        upload = chunked_uploads.init(collection_name, filename, size, str(data.get('fingerprint', '')))
+        
+        return jsonify({
+            'success': True,
+            'upload_url': f"/api/admin/uploads/{quote(collection_name)}/{upload['upload_id']}",
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+            **upload
+        })
+        
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@app.route('/api/admin/uploads/<collection_name>/<upload_id>', methods=['GET'])
+def upload_status(collection_name, upload_id):
+    """Report how many bytes of a chunked upload have been received"""
+    try:
+        return jsonify({
+            'success': True,
+            **chunked_uploads.status(collection_name, upload_id)
+        })
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@app.route('/api/admin/uploads/<collection_name>/<upload_id>', methods=['PUT'])
+def upload_chunk(collection_name, upload_id):
+    """Append the raw request body to a chunked upload at ?offset="""
+    try:
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({
+                'success': False,
+                'message': 'Chunk offset is required'
+            }), 400
+        
+        # Read the body as a stream so chunks go straight to disk
+        offset = chunked_uploads.write_chunk(collection_name, upload_id, offset, request.stream)
+        
+        return jsonify({
+            'success': True,
+            'offset': offset
+        })
+        
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@app.route('/api/admin/uploads/<collection_name>/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(collection_name, upload_id):
+    """Move a completed chunked upload into its collection"""
+    try:
+        filename, part_path, content_hash = chunked_uploads.finalize(collection_name, upload_id)
+        stored, duplicate_of, similar_to = store_upload(collection_name, filename, part_path, content_hash)
+        chunked_uploads.complete(collection_name, upload_id)
+        
+        if stored is None:
+            return jsonify({
+                'success': True,
+                'message': f'"{filename}" is already in this collection as "{duplicate_of}"',
+                'duplicate_of': duplicate_of
+            })
+        
+        return jsonify({
+            'success': True,
+            'message': f'Uploaded "{stored}" successfully',
+            'filename': stored,
+            'similar_to': similar_to
+        })
+        
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@app.route('/api/admin/uploads/<collection_name>/<upload_id>', methods=['DELETE'])
+def abort_upload(collection_name, upload_id):
+    """Discard a chunked upload"""
+    try:
+        chunked_uploads.status(collection_name, upload_id)
+        chunked_uploads.complete(collection_name, upload_id, placed=False)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Upload cancelled'
+        })
+        
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
 @app.route('/api/admin/photos/<collection_name>/<filename>', methods=['DELETE'])
 def delete_photo(collection_name, filename):
     """Delete a specific photo"""
@@ -338,6 +1095,9 @@ def delete_photo(collection_name, filename):
             }), 404
         
         os.remove(file_path)
+        catalog.remove_photo(collection_name, filename)
+        pregeneration.forget(collection_name, filename)
+        rendition_cache.invalidate(collection_name, filename)
         
         return jsonify({
             'success': True,
@@ -350,7 +1110,177 @@ def delete_photo(collection_name, filename):
             'message': str(e)
         }), 500
 
+@app.route('/api/admin/catalog/reconcile', methods=['POST'])
+def reconcile_catalog_route():
+    """Rescan COLLECTIONS_DIR and repair the photo catalog"""
+    try:
+        data = request.get_json(silent=True) or {}
+        changes = reconcile_catalog(data.get('collection'))
+        request_placeholder_backfill()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Catalog reconciled',
+            'added': len(changes['added']),
+            'updated': len(changes['updated']),
+            'removed': len(changes['removed'])
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@app.route('/api/admin/duplicates')
+def list_duplicates():
+    """Clusters of photos that look alike, across all collections or touching one"""
+    try:
+        collection_name = request.args.get('collection')
+        distance = request.args.get('distance', DUPLICATE_DISTANCE, type=int)
+        if not 0 <= distance <= MAX_DUPLICATE_DISTANCE:
+            return jsonify({
+                'success': False,
+                'message': f'distance must be between 0 and {MAX_DUPLICATE_DISTANCE}'
+            }), 400
+        
+        clusters = [
+            [
+                {'collection': name, 'filename': filename, 'url': photo_url(name, filename, 'thumb')}
+                for name, filename in cluster
+            ]
+            for cluster in duplicate_clusters(similarity_index()[1], distance)
+            if collection_name is None or any(name == collection_name for name, _ in cluster)
+        ]
+        
+        return jsonify({
+            'success': True,
+            'distance': distance,
+            'clusters': clusters,
+            'duplicate_photos': sum(len(cluster) - 1 for cluster in clusters)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@app.route('/api/admin/renditions/warm', methods=['POST'])
+def warm_renditions():
+    """Queue rendition generation for every photo, or for one collection"""
+    try:
+        data = request.get_json(silent=True) or {}
+        collection_name = data.get('collection')
+        
+        if collection_name and not os.path.isdir(os.path.join(COLLECTIONS_DIR, collection_name)):
+            return jsonify({
+                'success': False,
+                'message': 'Collection not found'
+            }), 404
+        
+        queued = 0
+        for name, filename, path in iter_photo_files(collection_name):
+            pregeneration.submit(name, filename, path)
+            queued += 1
+        
+        return jsonify({
+            'success': True,
+            'message': f'Queued {queued} photo(s) for rendition',
+            'queued': queued
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@app.route('/api/admin/renditions/status')
+def rendition_status():
+    """Report pending and failed background rendition jobs per collection"""
+    try:
+        return jsonify({
+            'success': True,
+            'collections': pregeneration.status()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+# CLI Commands
+@app.cli.command('warm-renditions')
+@click.option('--collection', default=None, help='Only warm this collection.')
+@click.option('--workers', default=RENDITION_WORKERS, show_default=True, help='Parallel render processes.')
+def warm_renditions_command(collection, workers):
+    """Pre-generate every preset rendition under COLLECTIONS_DIR"""
+    queue = PregenerationQueue(rendition_cache, workers)
+    futures = {
+        queue.submit(name, filename, path): f'{name}/{filename}'
+        for name, filename, path in iter_photo_files(collection)
+    }
+    
+    rendered = failed = 0
+    for future in as_completed(futures):
+        try:
+            rendered += future.result()
+        except Exception as e:
+            failed += 1
+            click.echo(f'Failed {futures[future]}: {e}', err=True)
+    queue.shutdown()
+    
+    click.echo(f'Warmed {len(futures)} photo(s): {rendered} rendition(s) written, {failed} failed')
+
+@app.cli.command('reconcile-catalog')
+@click.option('--collection', default=None, help='Only rescan this collection.')
+def reconcile_catalog_command(collection):
+    """Rescan COLLECTIONS_DIR and repair the photo catalog"""
+    changes = reconcile_catalog(collection)
+    click.echo(
+        f"Catalog reconciled: {len(changes['added'])} added, "
+        f"{len(changes['updated'])} updated, {len(changes['removed'])} removed"
+    )
+    backfilled = 0
+    while True:
+        count = catalog.backfill_placeholders(PLACEHOLDER_BACKFILL_BATCH)
+        if not count:
+            break
+        backfilled += count
+    click.echo(f"Placeholders computed for {backfilled} photo(s)")
+
 # Frontend Routes
+_index_html_cache = {}
+
+def static_asset_version(asset):
+    """Version token of a static asset, derived from its size and mtime"""
+    asset_stat = os.stat(os.path.join(app.static_folder, asset))
+    return source_version(asset_stat.st_size, asset_stat.st_mtime)
+
+def render_index():
+    """Serve index.html with versioned asset URLs so assets can be cached immutably"""
+    index_path = os.path.join(app.static_folder, 'index.html')
+    index_stat = os.stat(index_path)
+    versions = tuple(static_asset_version(asset) for asset in STATIC_VERSIONED_ASSETS)
+    cache_key = (index_stat.st_mtime_ns, index_stat.st_size, versions)
+    
+    if _index_html_cache.get('key') != cache_key:
+        with open(index_path, encoding='utf-8') as index_file:
+            html = index_file.read()
+        for asset, version in zip(STATIC_VERSIONED_ASSETS, versions):
+            html = html.replace(f'"/{asset}"', f'"/{asset}?v={version}"')
+        _index_html_cache.update(
+            key=cache_key,
+            html=html,
+            etag=hashlib.sha1(html.encode('utf-8')).hexdigest()
+        )
+    
+    response = app.response_class(_index_html_cache['html'], mimetype='text/html')
+    response.set_etag(_index_html_cache['etag'])
+    apply_cache_policy(response, versioned=False)
+    return response.make_conditional(request)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -358,12 +1288,13 @@ def serve(path):
     if static_folder_path is None:
             return "Static folder not configured", 404
 
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
+    if path not in ("", "index.html") and os.path.exists(os.path.join(static_folder_path, path)):
+        versioned = path in STATIC_VERSIONED_ASSETS and request.args.get('v') == static_asset_version(path)
+        return apply_cache_policy(send_from_directory(static_folder_path, path), versioned)
     else:
         index_path = os.path.join(static_folder_path, 'index.html')
         if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+            return render_index()
         else:
             return "index.html not found", 404
 
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from src import filelock
+
+# Every process (gunicorn workers and rendition pool processes) snapshots its
+# metrics into <METRICS_DIR>/<pid>.json; /metrics sums the snapshots of live processes
+METRICS_DIR = os.environ.get(
+    'METRICS_DIR',
+    os.path.join(
+        tempfile.gettempdir(),
+        'gallery-metrics-' + hashlib.sha1(os.path.abspath(__file__).encode('utf-8')).hexdigest()[:12]
+    )
+)
+FLUSH_INTERVAL = 1.0
+# Totals of processes that have exited, kept so counters never go backwards
+ARCHIVE_FILE = 'archive.json'
+
+# Upper bounds in seconds; tuned for a mix of cache hits (ms) and cold renders (s)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'gallery_http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'gallery_http_response_bytes_total': ('counter', 'Response body bytes sent by route'),
+    'gallery_http_request_duration_seconds': ('histogram', 'Wall time spent handling requests'),
+    'gallery_image_phase_seconds': ('histogram', 'Time spent in each phase of the image pipeline'),
+    'gallery_rendition_cache_total': ('counter', 'Rendition cache lookups by result'),
+    'gallery_render_jobs_total': ('counter', 'On-demand render requests by outcome'),
+}
+
+
+class Registry:
+    """Counters and histograms for one process, flushed to disk in the background"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._dirty = False
+        self._flusher = None
+        self._pid = None
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._dirty = True
+        self._ensure_flusher()
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    series[index] += 1
+            series[len(DURATION_BUCKETS)] += 1
+            series[-1] += value
+            self._dirty = True
+        self._ensure_flusher()
+
+    def snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(series)] for (name, labels), series in self._histograms.items()],
+            }
+
+    def flush(self):
+        """Write this process's snapshot atomically"""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(self.snapshot(), tmp_file)
+        os.replace(tmp_path, os.path.join(self.directory, f'{os.getpid()}.json'))
+
+    def _ensure_flusher(self):
+        # Started lazily and restarted after a fork, where the thread doesn't survive
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            if self._dirty:
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+
+registry = Registry(METRICS_DIR)
+
+
+def flush():
+    """Publish this process's metrics now instead of waiting for the background flush"""
+    try:
+        registry.flush()
+    except OSError:
+        pass
+
+
+def inc(name, amount=1, **labels):
+    registry.inc(name, labels, amount)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, labels, value)
+
+
+@contextmanager
+def phase(name, **labels):
+    """Time a block of the image pipeline"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('gallery_image_phase_seconds', time.perf_counter() - started, phase=name, **labels)
+
+
+def pid_alive(pid):
+    """Whether a process with this pid is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path):
+    with open(path) as snapshot_file:
+        return json.load(snapshot_file)
+
+
+def _merge(snapshot, counters, histograms):
+    for metric, labels, value in snapshot['counters']:
+        key = (metric, tuple(tuple(label) for label in labels))
+        counters[key] = counters.get(key, 0) + value
+    for metric, labels, series in snapshot['histograms']:
+        key = (metric, tuple(tuple(label) for label in labels))
+        total = histograms.setdefault(key, [0] * len(series))
+        for index, value in enumerate(series):
+            total[index] += value
+
+
+def _archive(directory, dead_paths):
+    """Fold the snapshots of exited processes into the archive, then remove them"""
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    counters, histograms = {}, {}
+    try:
+        _merge(_read_snapshot(archive_path), counters, histograms)
+    except FileNotFoundError:
+        pass
+    for path in dead_paths:
+        try:
+            _merge(_read_snapshot(path), counters, histograms)
+        except (OSError, ValueError):
+            pass
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as tmp_file:
+        json.dump({
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), series] for (name, labels), series in histograms.items()],
+        }, tmp_file)
+    os.replace(tmp_path, archive_path)
+    for path in dead_paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def collect(directory=METRICS_DIR):
+    """Sum the snapshots of every live process and the archive of exited ones
+
+    Counters must never go down, or Prometheus reads a reset and counts the
+    whole remaining total as new increments. So when a process has exited
+    (a recycled gunicorn worker or pool process), its final snapshot is
+    folded into the archive rather than dropped.
+    """
+    registry.flush()
+    counters, histograms = {}, {}
+
+    # Serialize with other workers' scrapes, so none sees a snapshot after
+    # it was archived but before the archive includes it
+    with filelock.exclusive(os.path.join(directory, ARCHIVE_FILE + '.lock')):
+        snapshot_paths = [
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.endswith('.json') and name != ARCHIVE_FILE
+        ]
+        dead = [path for path in snapshot_paths if not pid_alive(int(os.path.basename(path)[:-5]))]
+        if dead:
+            _archive(directory, dead)
+
+        for path in [os.path.join(directory, ARCHIVE_FILE)] + snapshot_paths:
+            if path in dead:
+                continue
+            try:
+                _merge(_read_snapshot(path), counters, histograms)
+            except (OSError, ValueError):
+                continue
+
+    return counters, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def render_prometheus(directory=METRICS_DIR):
+    """Aggregated metrics in the Prometheus text exposition format"""
+    counters, histograms = collect(directory)
+    lines = []
+    for metric, (kind, help_text) in HELP.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        if kind == 'counter':
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f'{metric}{_format_labels(labels)} {value}')
+        else:
+            for (name, labels), series in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                for bound, count in zip(DURATION_BUCKETS, series):
+                    lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {count}')
+                count = series[len(DURATION_BUCKETS)]
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{metric}_sum{_format_labels(labels)} {series[-1]}')
+                lines.append(f'{metric}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,66 @@
+from datetime import datetime
+from src.models.user import db
+
+class Photo(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('collection', 'filename', name='uq_photo_collection_filename'),
+        db.Index('ix_photo_collection_uploaded', 'collection', 'uploaded_at', 'id'),
+        db.Index('ix_photo_collection_size', 'collection', 'size'),
+        db.Index('ix_photo_collection_taken', 'collection', 'taken_at', 'id'),
+        db.Index('ix_photo_collection_camera', 'collection', 'camera'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    collection = db.Column(db.String(255), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    mtime = db.Column(db.Float, nullable=False)
+    # Dimensions of the upright image, after EXIF orientation
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    format = db.Column(db.String(16))
+    # EXIF capture time, or the file's mtime when the photo has none
+    taken_at = db.Column(db.DateTime, nullable=False)
+    orientation = db.Column(db.SmallInteger)
+    camera = db.Column(db.String(255))
+    has_gps = db.Column(db.Boolean, nullable=False, default=False)
+    # SHA-256 of the file contents; filled lazily when a same-size upload arrives
+    content_hash = db.Column(db.String(64))
+    # Tiny data: URI shown while the real image loads
+    placeholder = db.Column(db.Text)
+    # 64-bit dHash as hex, for finding near-duplicates across collections
+    perceptual_hash = db.Column(db.String(16))
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Photo {self.collection}/{self.filename}>'
+
+    def to_dict(self):
+        return {
+            'collection': self.collection,
+            'filename': self.filename,
+            'size': self.size,
+            'width': self.width,
+            'height': self.height,
+            'format': self.format,
+            'taken_at': self.taken_at.isoformat() if self.taken_at else None,
+            'camera': self.camera,
+            'has_gps': self.has_gps
+        }
+
+class Collection(db.Model):
+    name = db.Column(db.String(255), primary_key=True)
+    photo_count = db.Column(db.Integer, nullable=False, default=0)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    preview_filename = db.Column(db.String(255))
+    preview_version = db.Column(db.String(16))
+    preview_placeholder = db.Column(db.Text)
+    dominant_format = db.Column(db.String(16))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Collection {self.name}>'
+
+class CatalogMeta(db.Model):
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.String(255), nullable=False)
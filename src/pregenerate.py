@@ -0,0 +1,232 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from src import metrics
+from src.imaging import (
+    RENDITION_WIDTHS, available_formats, display_format_for, quality_for, render_renditions,
+)
+from src.rendition_cache import RenditionCache
+
+# Seconds between publishing job state changes for other processes to read
+PUBLISH_INTERVAL = 1.0
+
+# The pool process's cache handle, reused across jobs so its byte count is
+# walked from disk once per process rather than once per job
+_pool_cache = None
+
+
+def pregenerate_renditions(cache_root, cache_max_bytes, collection, filename, image_path):
+    """Encode every preset rendition of one photo into the cache.
+
+    Runs inside a pool process, so it only takes picklable arguments and
+    keeps its own cache handle. Returns the number of renditions written.
+    Nothing more is written once the source is deleted or replaced.
+    """
+    global _pool_cache
+    if _pool_cache is None or (_pool_cache.root, _pool_cache.max_bytes) != (cache_root, cache_max_bytes):
+        _pool_cache = RenditionCache(cache_root, cache_max_bytes)
+    cache = _pool_cache
+    source_stat = os.stat(image_path)
+    # Every format a client may negotiate, plus the fallback for everyone else
+    output_formats = [display_format_for(filename)] + available_formats()
+
+    keys = {
+        (width, fmt): cache.key(collection, filename, source_stat, width, None, quality_for(fmt), fmt)
+        for width in RENDITION_WIDTHS
+        for fmt in dict.fromkeys(output_formats)
+    }
+    missing = [target for target, key in keys.items() if cache.get(collection, filename, key, target[1]) is None]
+    if not missing:
+        return 0
+
+    written = 0
+    try:
+        for (width, fmt), data in render_renditions(image_path, missing).items():
+            if not _unchanged(image_path, source_stat):
+                # Deleted or replaced while we rendered, and its renditions
+                # invalidated; writing now would leave orphans in the cache
+                break
+            cache.put(collection, filename, keys[width, fmt], fmt, data)
+            written += 1
+    finally:
+        # Publish phase timings now; pool processes can be torn down without notice
+        metrics.flush()
+    return written
+
+
+def _unchanged(path, stat):
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return (current.st_size, current.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+
+class PregenerationQueue:
+    """Background rendition jobs on a process pool, tracked per collection.
+
+    The pool is created on first use, so each gunicorn worker owns its own
+    pool. Each process publishes its job state to <state_dir>/<pid>.json,
+    and status() sums the files of live processes, so every worker (and a
+    warm-renditions command) reports the same jobs.
+    """
+
+    def __init__(self, cache, max_workers, state_dir=None):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.state_dir = state_dir or os.path.join(
+            tempfile.gettempdir(),
+            'gallery-rendition-jobs-' + hashlib.sha1(os.path.abspath(cache.root).encode('utf-8')).hexdigest()[:12]
+        )
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = {}  # collection -> {filename: future}
+        self._failed = {}   # collection -> {filename: error message}
+        self._dirty = False
+        self._publisher_pid = None
+
+    def submit(self, collection, filename, image_path):
+        """Queue rendition generation for a photo and return its future"""
+        with self._lock:
+            pending = self._pending.setdefault(collection, {})
+            if filename in pending:
+                return pending[filename]
+
+            self._failed.get(collection, {}).pop(filename, None)
+            args = (self.cache.root, self.cache.max_bytes, collection, filename, image_path)
+            try:
+                future = self._get_executor().submit(pregenerate_renditions, *args)
+            except BrokenProcessPool:
+                # A pool process died (e.g. OOM on a huge original); start a fresh pool
+                self._executor = None
+                future = self._get_executor().submit(pregenerate_renditions, *args)
+            pending[filename] = future
+            self._dirty = True
+
+        self._ensure_publisher()
+        future.add_done_callback(partial(self._finished, collection, filename))
+        return future
+
+    def forget(self, collection, filename=None):
+        """Cancel and stop tracking jobs for a deleted photo or collection"""
+        with self._lock:
+            if filename is None:
+                futures = list(self._pending.pop(collection, {}).values())
+                self._failed.pop(collection, None)
+            else:
+                future = self._pending.get(collection, {}).pop(filename, None)
+                futures = [future] if future else []
+                self._failed.get(collection, {}).pop(filename, None)
+            self._dirty = True
+
+        for future in futures:
+            future.cancel()
+
+    def status(self):
+        """Pending and failed job counts per collection, across all processes"""
+        self.publish()
+        pending, failed = {}, {}
+        for name in os.listdir(self.state_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.state_dir, name)
+            if not metrics.pid_alive(int(name[:-5])):
+                # Its pool is gone with it, so none of its jobs will finish
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                with open(path) as state_file:
+                    state = json.load(state_file)
+            except (OSError, ValueError):
+                continue
+            for collection, jobs in state.items():
+                pending.setdefault(collection, set()).update(jobs['pending'])
+                failed.setdefault(collection, {}).update(jobs['failed'])
+
+        return {
+            collection: {
+                'pending': len(pending.get(collection, ())),
+                'failed': [
+                    {'filename': filename, 'error': error}
+                    for filename, error in sorted(failed.get(collection, {}).items())
+                ]
+            }
+            for collection in sorted(set(pending) | set(failed))
+            if pending.get(collection) or failed.get(collection)
+        }
+
+    def publish(self):
+        """Write this process's job state atomically"""
+        with self._lock:
+            self._dirty = False
+            state = {
+                collection: {
+                    'pending': sorted(self._pending.get(collection, {})),
+                    'failed': dict(self._failed.get(collection, {}))
+                }
+                for collection in set(self._pending) | set(self._failed)
+            }
+        os.makedirs(self.state_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(state, tmp_file)
+        os.replace(tmp_path, os.path.join(self.state_dir, f'{os.getpid()}.json'))
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn keeps pool processes independent of the threads in the web worker
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def _finished(self, collection, filename, future):
+        with self._lock:
+            pending = self._pending.get(collection, {})
+            if pending.get(filename) is not future:
+                # Forgotten or superseded while running
+                return
+            del pending[filename]
+            if not pending:
+                del self._pending[collection]
+
+            if not future.cancelled() and future.exception() is not None:
+                self._failed.setdefault(collection, {})[filename] = str(future.exception())
+            self._dirty = True
+
+    def _ensure_publisher(self):
+        # Started lazily and restarted after a fork, like the metrics flusher
+        if self._publisher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._publisher_pid == os.getpid():
+                return
+            self._publisher_pid = os.getpid()
+            threading.Thread(target=self._publish_loop, name='rendition-jobs-publish', daemon=True).start()
+
+    def _publish_loop(self):
+        while True:
+            time.sleep(PUBLISH_INTERVAL)
+            if self._dirty:
+                try:
+                    self.publish()
+                except OSError:
+                    pass
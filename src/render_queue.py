@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from src import metrics
+
+
+class RenderBusy(Exception):
+    """The render queue is full, or a render took too long; the client should retry"""
+
+    def __init__(self, retry_after):
+        super().__init__('Image rendering is busy, please retry')
+        self.retry_after = retry_after
+
+
+class RenderQueue:
+    """Bounded thread pool for on-demand renders, with single-flight per key.
+
+    Pillow releases the GIL while decoding, resizing and encoding, so a few
+    render threads use the CPU while the web threads stay free for cheap
+    routes. Every caller blocked in run() holds a web server thread, so at
+    most max_waiters callers may wait at a time, whether they started a job
+    or joined one; past that, and when max_waiters jobs are already queued
+    or running, run() raises RenderBusy instead of letting requests pile up.
+    Concurrent run() calls with the same key share one job and its result.
+    """
+
+    def __init__(self, max_workers, max_waiters, timeout=30.0, retry_after=2):
+        self.max_workers = max_workers
+        self.max_waiters = max_waiters
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='render')
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> future
+        self._waiters = 0
+
+    def run(self, key, fn, *args):
+        """Run fn(*args) for key, or wait for the identical job already running"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if self._waiters >= self.max_waiters or (future is None and len(self._inflight) >= self.max_waiters):
+                # Jobs whose callers timed out still count until they finish
+                metrics.inc('gallery_render_jobs_total', outcome='rejected')
+                raise RenderBusy(self.retry_after)
+            started = future is None
+            if started:
+                metrics.inc('gallery_render_jobs_total', outcome='started')
+                future = self._executor.submit(fn, *args)
+                self._inflight[key] = future
+            else:
+                metrics.inc('gallery_render_jobs_total', outcome='coalesced')
+            self._waiters += 1
+
+        if started:
+            # Outside the lock: a job that already finished runs the callback
+            # right here, and _finished takes the lock itself
+            future.add_done_callback(partial(self._finished, key))
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # The job keeps running and will fill the cache for the retry
+            metrics.inc('gallery_render_jobs_total', outcome='timed_out')
+            raise RenderBusy(self.retry_after)
+        finally:
+            with self._lock:
+                self._waiters -= 1
+
+    def depth(self):
+        """Jobs currently queued or running"""
+        with self._lock:
+            return len(self._inflight)
+
+    def waiting(self):
+        """Callers currently blocked waiting for a job"""
+        with self._lock:
+            return self._waiters
+
+    def _finished(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from src import filelock
+
+# Bump whenever the rendition pipeline changes its output so stale entries miss
+RENDITION_VERSION = 3
+
+
+def _digest(value):
+    """Short stable directory name for an arbitrary collection or file name"""
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()[:16]
+
+
+class RenditionCache:
+    """On-disk store of encoded renditions with an LRU size budget.
+
+    Entries live under ``<root>/<collection digest>/<file digest>/`` so a
+    photo or a whole collection can be invalidated with a single rmtree.
+    Recency is tracked through the entry mtime, which is bumped on every hit.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def key(self, collection, filename, source_stat, width, height, quality, fmt):
+        """Content-addressed key for a rendition of a specific source version"""
+        parts = (
+            RENDITION_VERSION, collection, filename,
+            source_stat.st_mtime_ns, source_stat.st_size,
+            width, height, quality, fmt.upper(),
+        )
+        return hashlib.sha256('\0'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+    def path_for(self, collection, filename, key, fmt):
+        """Location of a cache entry on disk"""
+        return os.path.join(self._source_dir(collection, filename), f'{key}.{fmt.lower()}')
+
+    def get(self, collection, filename, key, fmt):
+        """Return the cached path for a key, or None on a miss"""
+        path = self.path_for(collection, filename, key, fmt)
+        try:
+            # Mark as recently used for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, collection, filename, key, fmt, data):
+        """Atomically store encoded bytes and return the cached path"""
+        path = self.path_for(collection, filename, key, fmt)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._account(len(data))
+        return path
+
+    @contextmanager
+    def lock(self, collection, filename, key):
+        """Hold an exclusive lock on one entry, so only one process renders it"""
+        path = os.path.join(self._source_dir(collection, filename), f'{key}.lock')
+        with filelock.exclusive(path, remove=True):
+            yield
+
+    def invalidate(self, collection, filename=None):
+        """Drop every rendition of a photo, or of a whole collection"""
+        directory = self._source_dir(collection, filename)
+        removed = sum(size for _, size, _ in self._entries(directory))
+        shutil.rmtree(directory, ignore_errors=True)
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes = max(0, self._total_bytes - removed)
+
+    def _source_dir(self, collection, filename=None):
+        if filename is None:
+            return os.path.join(self.root, _digest(collection))
+        return os.path.join(self.root, _digest(collection), _digest(filename))
+
+    def _account(self, nbytes):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += nbytes
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self, directory=None):
+        for dirpath, _, filenames in os.walk(directory or self.root):
+            for name in filenames:
+                if name.endswith(('.tmp', '.lock')):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        # Other workers share the directory, so rescan instead of trusting our count
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        # Evict down to a low-water mark so we don't rescan on every write
+        target = int(self.max_bytes * 0.9)
+
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        self._total_bytes = total
@@ -0,0 +1,155 @@
+import threading
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+
+# Rows of a bucket compared against the whole bucket at once; bounds the
+# (rows x bucket) distance matrix for crowded buckets
+PAIR_CHUNK_ROWS = 512
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes"""
+    return (a ^ b).bit_count()
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(size, radius):
+    """XOR masks flipping at most radius of size bits, 0 first"""
+    return tuple(
+        sum(1 << position for position in positions)
+        for flipped in range(radius + 1)
+        for positions in combinations(range(size), flipped)
+    )
+
+
+class MultiIndexHash:
+    """Multi-index hashing over integer hashes under the Hamming distance.
+
+    Hashes are split into `blocks` disjoint bit ranges, each with its own
+    table from block value to hashes. By the pigeonhole principle a hash
+    within radius r of a query differs in at most r // blocks bits of some
+    block, so a query only looks up those few block values and compares the
+    candidates it finds in full, instead of scanning every hash. With
+    blocks = radius + 1 that is a single exact lookup per block. Items with
+    identical hashes share an entry. add() may run while other threads query.
+    """
+
+    def __init__(self, bits=64, blocks=7):
+        self.blocks = blocks
+        self._spans = []  # (shift, block size) from the high bits down
+        shift = bits
+        for index in range(blocks):
+            size = bits // blocks + (1 if index < bits % blocks else 0)
+            shift -= size
+            self._spans.append((shift, size))
+        self._items = {}  # hash -> [items]
+        self._tables = [{} for _ in range(blocks)]  # block value -> [hashes]
+        self._lock = threading.Lock()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value, item):
+        with self._lock:
+            self._size += 1
+            items = self._items.get(value)
+            if items is not None:
+                items.append(item)
+                return
+            self._items[value] = [item]
+            for table, (shift, size) in zip(self._tables, self._spans):
+                table.setdefault((value >> shift) & ((1 << size) - 1), []).append(value)
+
+    def search(self, value, radius):
+        """(distance, item) pairs within radius of value, nearest first"""
+        results = [
+            (distance, item)
+            for distance, match in self.search_hashes(value, radius)
+            for item in list(self._items[match])
+        ]
+        results.sort(key=lambda result: result[0])
+        return results
+
+    def search_hashes(self, value, radius):
+        """(distance, hash) of every distinct hash within radius of value"""
+        block_radius = radius // self.blocks
+        seen = set()
+        results = []
+        for table, (shift, size) in zip(self._tables, self._spans):
+            block = (value >> shift) & ((1 << size) - 1)
+            for mask in _flip_masks(size, block_radius):
+                for candidate in table.get(block ^ mask, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    distance = hamming(value, candidate)
+                    if distance <= radius:
+                        results.append((distance, candidate))
+        return results
+
+    def near_pairs(self, radius):
+        """(hash, hash) pairs within radius of each other; a pair may repeat
+
+        When radius < blocks, every such pair shares a bucket in some table,
+        so only hashes within a bucket are compared, vectorized with NumPy.
+        Larger radii fall back to one query per hash.
+        """
+        if radius >= self.blocks:
+            for value, _ in self.entries():
+                for _, match in self.search_hashes(value, radius):
+                    if match != value:
+                        yield value, match
+            return
+
+        with self._lock:
+            buckets = [list(bucket) for table in self._tables for bucket in table.values() if len(bucket) > 1]
+        for bucket in buckets:
+            hashes = np.array(bucket, dtype=np.uint64)
+            for start in range(0, len(hashes), PAIR_CHUNK_ROWS):
+                rows = hashes[start:start + PAIR_CHUNK_ROWS]
+                distances = np.bitwise_count(rows[:, None] ^ hashes[None, :])
+                for row, column in zip(*np.nonzero(distances <= radius)):
+                    if start + row < column:
+                        yield bucket[start + row], bucket[column]
+
+    def entries(self):
+        """(hash, items) of every distinct hash"""
+        with self._lock:
+            return [(value, list(items)) for value, items in self._items.items()]
+
+
+def duplicate_clusters(index, radius):
+    """Group the items of a MultiIndexHash whose hashes are within radius of each other.
+
+    Near pairs come from shared buckets (see MultiIndexHash.near_pairs) and
+    are joined with union-find, so no hash is compared with every other.
+    Clusters are transitive: A~B and B~C put A and C together. Returns lists
+    of at least two items, largest cluster first.
+    """
+    entries = index.entries()
+    parent = {value: value for value, _ in entries}
+
+    def find(value):
+        while parent[value] != value:
+            parent[value] = parent[parent[value]]
+            value = parent[value]
+        return value
+
+    for value, match in index.near_pairs(radius):
+        if value not in parent or match not in parent:
+            # Added after the snapshot; picked up by the next call
+            continue
+        root, match_root = find(value), find(match)
+        if root != match_root:
+            parent[match_root] = root
+
+    clusters = {}
+    for value, items in entries:
+        clusters.setdefault(find(value), []).extend(items)
+    return sorted(
+        (sorted(items) for items in clusters.values() if len(items) > 1),
+        key=len, reverse=True
+    )
@@ -3,8 +3,20 @@ class PhotoGallery {
         this.currentCollection = null;
         this.collections = [];
         this.photos = [];
+        this.photosCursor = null;
+        this.photosTotal = 0;
+        this.photoPageSize = 60;
+        this.photoSort = 'name';
+        this.loadingPhotos = false;
+        this.photosObserver = null;
         this.isAdmin = false;
         this.currentView = 'gallery'; // gallery, collection, admin, login
+        this.collectionsVersion = null;
+        this.coverSprite = null;
+        this.versionPollInterval = 30000;
+        // Rendered widths of grid images, used to pick a srcset candidate
+        this.collectionImageSizes = '(max-width: 768px) 100vw, 400px';
+        this.photoImageSizes = '(max-width: 768px) 50vw, 300px';
         this.init();
     }
 
@@ -12,6 +24,25 @@ class PhotoGallery {
         this.bindEvents();
         this.checkAdminStatus();
         await this.loadCollections();
+        this.pollCollectionsVersion();
+    }
+
+    pollCollectionsVersion() {
+        // Cheap check for photos added or removed elsewhere; reload only on change
+        setInterval(async () => {
+            if (document.hidden) {
+                return;
+            }
+            try {
+                const response = await fetch('/api/collections/version');
+                const data = await response.json();
+                if (data.success && data.version !== this.collectionsVersion) {
+                    await this.loadCollections();
+                }
+            } catch (error) {
+                console.error('Error checking for collection changes:', error);
+            }
+        }, this.versionPollInterval);
     }
 
     bindEvents() {
@@ -20,6 +51,13 @@ class PhotoGallery {
             this.showGalleryView();
         });
 
+        document.getElementById('photoSort').addEventListener('change', (e) => {
+            this.photoSort = e.target.value;
+            if (this.currentCollection) {
+                this.openCollection(this.currentCollection);
+            }
+        });
+
         document.getElementById('adminLink').addEventListener('click', (e) => {
             e.preventDefault();
             this.showAdminView();
@@ -54,6 +92,9 @@ class PhotoGallery {
         // Upload events
         this.setupUploadEvents();
 
+        // Infinite scroll for collection photos
+        this.setupInfiniteScroll();
+
         // Modal close events
         document.addEventListener('keydown', (e) => {
             if (e.key === 'Escape') {
@@ -100,6 +141,19 @@ class PhotoGallery {
         });
     }
 
+    setupInfiniteScroll() {
+        const sentinel = document.getElementById('photosSentinel');
+
+        // Start fetching the next page well before the user reaches the end
+        this.photosObserver = new IntersectionObserver((entries) => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                this.loadMorePhotos();
+            }
+        }, { rootMargin: '800px 0px' });
+
+        this.photosObserver.observe(sentinel);
+    }
+
     checkAdminStatus() {
         const adminToken = localStorage.getItem('adminToken');
         if (adminToken === 'authenticated') {
@@ -164,6 +218,8 @@ class PhotoGallery {
             
             if (data.success) {
                 this.collections = data.collections;
+                this.coverSprite = data.cover_sprite;
+                this.collectionsVersion = data.version;
                 this.renderCollections();
                 if (this.isAdmin) {
                     this.renderAdminCollections();
@@ -190,10 +246,7 @@ class PhotoGallery {
         grid.innerHTML = this.collections.map(collection => `
             <div class="collection-card" onclick="gallery.openCollection('${collection.name}')">
                 <div class="collection-preview">
-                    ${collection.preview_url ? 
-                        `<img src="${collection.preview_url}" alt="${collection.name}" loading="lazy">` :
-                        `<div class="collection-placeholder">📁</div>`
-                    }
+                    ${collection.preview_url ? this.renderCollectionCover(collection) : `<div class="collection-placeholder">📁</div>`}
                 </div>
                 <div class="collection-info">
                     <h3 class="collection-name">${collection.name}</h3>
@@ -214,10 +267,7 @@ class PhotoGallery {
         grid.innerHTML = this.collections.map(collection => `
             <div class="collection-card">
                 <div class="collection-preview">
-                    ${collection.preview_url ? 
-                        `<img src="${collection.preview_url}" alt="${collection.name}" loading="lazy">` :
-                        `<div class="collection-placeholder">📁</div>`
-                    }
+                    ${collection.preview_url ? this.renderCollectionCover(collection) : `<div class="collection-placeholder">📁</div>`}
                 </div>
                 <div class="collection-info">
                     <h3 class="collection-name">${collection.name}</h3>
@@ -239,15 +289,28 @@ class PhotoGallery {
             ).join('');
     }
 
+    async fetchPhotoPage(collectionName, cursor) {
+        const params = new URLSearchParams({ limit: this.photoPageSize, sort: this.photoSort });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+
+        const response = await fetch(`/api/collections/${encodeURIComponent(collectionName)}/photos?${params}`);
+        return response.json();
+    }
+
     async openCollection(collectionName) {
         this.currentCollection = collectionName;
+        this.photos = [];
+        this.photosCursor = null;
         
         try {
-            const response = await fetch(`/api/collections/${encodeURIComponent(collectionName)}/photos`);
-            const data = await response.json();
+            const data = await this.fetchPhotoPage(collectionName, null);
             
             if (data.success) {
                 this.photos = data.photos;
+                this.photosCursor = data.next_cursor;
+                this.photosTotal = data.total;
                 this.showCollectionView(collectionName);
                 this.renderPhotos();
             } else {
@@ -260,6 +323,48 @@ class PhotoGallery {
         }
     }
 
+    async loadMorePhotos() {
+        if (this.loadingPhotos || !this.photosCursor || this.currentView !== 'collection') {
+            return;
+        }
+
+        const collectionName = this.currentCollection;
+        this.loadingPhotos = true;
+
+        try {
+            const data = await this.fetchPhotoPage(collectionName, this.photosCursor);
+
+            // Ignore pages for a collection the user already navigated away from
+            if (collectionName !== this.currentCollection) {
+                return;
+            }
+
+            if (data.success) {
+                this.photos.push(...data.photos);
+                this.photosCursor = data.next_cursor;
+                this.photosTotal = data.total;
+                document.getElementById('photosGrid').insertAdjacentHTML('beforeend', this.renderPhotoItems(data.photos));
+            } else {
+                console.error('Failed to load more photos:', data.message);
+                this.photosCursor = null;
+            }
+        } catch (error) {
+            console.error('Error loading more photos:', error);
+        } finally {
+            this.loadingPhotos = false;
+            this.refreshPhotosSentinel();
+        }
+    }
+
+    refreshPhotosSentinel() {
+        // Re-observing fires the callback again if the sentinel is still on screen
+        const sentinel = document.getElementById('photosSentinel');
+        this.photosObserver.unobserve(sentinel);
+        if (this.photosCursor) {
+            this.photosObserver.observe(sentinel);
+        }
+    }
+
     renderPhotos() {
         const grid = document.getElementById('photosGrid');
         
@@ -268,9 +373,29 @@ class PhotoGallery {
             return;
         }
 
-        grid.innerHTML = this.photos.map(photo => `
-            <div class="photo-item" onclick="gallery.openPhotoModal('${photo.url}', '${photo.filename}', '${photo.collection}')">
-                <img src="${photo.url}" alt="${photo.filename}" loading="lazy">
+        grid.innerHTML = this.renderPhotoItems(this.photos);
+        this.refreshPhotosSentinel();
+    }
+
+    renderCollectionCover(collection) {
+        // Layers, each covering the last: inline placeholder, shared cover sprite, full image
+        const layers = [];
+        if (collection.preview_placeholder) {
+            layers.push(`<div class="cover-layer cover-placeholder" style="background-image: url('${collection.preview_placeholder}')"></div>`);
+        }
+        if (this.coverSprite && collection.sprite_index !== null) {
+            const tiles = this.coverSprite.tiles;
+            const position = tiles > 1 ? (collection.sprite_index / (tiles - 1)) * 100 : 0;
+            layers.push(`<div class="cover-layer" style="background-image: url('${this.coverSprite.url}'); background-size: 100% ${tiles * 100}%; background-position: 0 ${position}%"></div>`);
+        }
+        layers.push(`<img class="progressive" src="${collection.preview_url}" srcset="${collection.preview_srcset}" sizes="${this.collectionImageSizes}" alt="${collection.name}" loading="lazy" onload="this.classList.add('loaded')">`);
+        return layers.join('');
+    }
+
+    renderPhotoItems(photos) {
+        return photos.map(photo => `
+            <div class="photo-item" onclick="gallery.openPhotoModal('${photo.url}', '${photo.filename}', '${photo.collection}', '${photo.download_url}')">
+                <img src="${photo.urls.grid}" srcset="${photo.srcset}" sizes="${this.photoImageSizes}" alt="${photo.filename}" loading="lazy"${photo.placeholder ? ` style="background-image: url('${photo.placeholder}')"` : ''}>
                 <div class="photo-info">
                     <p class="photo-name">${photo.filename}</p>
                 </div>
@@ -290,6 +415,11 @@ class PhotoGallery {
         this.hideAllSections();
         document.getElementById('collectionSection').classList.remove('hidden');
         document.getElementById('collectionTitle').textContent = collectionName;
+
+        // The server streams every original as one ZIP
+        const downloadAllBtn = document.getElementById('downloadAllBtn');
+        downloadAllBtn.href = `/api/collections/${encodeURIComponent(collectionName)}/download.zip`;
+        downloadAllBtn.classList.toggle('hidden', !this.photosTotal);
         this.currentView = 'collection';
     }
 
@@ -319,7 +449,7 @@ class PhotoGallery {
         });
     }
 
-    openPhotoModal(photoUrl, filename, collection) {
+    openPhotoModal(photoUrl, filename, collection, downloadUrl) {
         const modal = document.getElementById('photoModal');
         const modalImage = document.getElementById('modalImage');
         const downloadBtn = document.getElementById('downloadBtn');
@@ -330,7 +460,7 @@ class PhotoGallery {
         
         // Set up download button
         downloadBtn.onclick = () => {
-            this.downloadPhoto(collection, filename);
+            this.downloadPhoto(collection, filename, downloadUrl);
         };
         
         // Show delete button only for admin
@@ -464,46 +594,104 @@ class PhotoGallery {
             return;
         }
 
-        const formData = new FormData();
-        formData.append('collection', selectedCollection);
-
-        for (let file of files) {
-            formData.append('files', file);
-        }
+        const progress = document.getElementById('uploadProgress');
+        const progressText = progress.querySelector('.alert');
+        const uploaded = [];
+        const duplicates = [];
+        const similar = [];
+        const errors = [];
 
         try {
-            document.getElementById('uploadProgress').classList.remove('hidden');
-            
-            const response = await fetch('/api/admin/upload', {
-                method: 'POST',
-                body: formData
-            });
-
-            const data = await response.json();
-
-            if (data.success) {
-                this.showAlert(data.message, 'success');
-                if (data.errors && data.errors.length > 0) {
-                    data.errors.forEach(error => {
-                        this.showAlert(error, 'error');
-                    });
+            progress.classList.remove('hidden');
+
+            // Files go one at a time in resumable chunks; a retry resumes where it stopped
+            for (const [index, file] of Array.from(files).entries()) {
+                progressText.textContent = `Uploading ${file.name} (${index + 1} of ${files.length})...`;
+
+                try {
+                    const data = await this.uploadFileInChunks(selectedCollection, file);
+                    if (data.duplicate_of) {
+                        duplicates.push(data.message);
+                    } else {
+                        uploaded.push(data.filename);
+                        if (data.similar_to && data.similar_to.length > 0) {
+                            const matches = data.similar_to.map(match => `${match.collection}/${match.filename}`);
+                            similar.push(`"${data.filename}" looks like ${matches.join(', ')}`);
+                        }
+                    }
+                } catch (error) {
+                    console.error(`Error uploading ${file.name}:`, error);
+                    errors.push(`Failed to upload ${file.name}: ${error.message}`);
                 }
-                await this.loadCollections();
-            } else {
-                this.showAlert(data.message, 'error');
             }
-        } catch (error) {
-            console.error('Error uploading files:', error);
-            this.showAlert('Failed to upload files', 'error');
+
+            if (uploaded.length > 0) {
+                this.showAlert(`Uploaded ${uploaded.length} file(s) successfully`, 'success');
+            }
+            duplicates.forEach(message => this.showAlert(`Skipped duplicate: ${message}`, 'error'));
+            similar.forEach(message => this.showAlert(`Possible duplicate: ${message}`, 'warning'));
+            errors.forEach(error => this.showAlert(error, 'error'));
+
+            await this.loadCollections();
         } finally {
-            document.getElementById('uploadProgress').classList.add('hidden');
+            progress.classList.add('hidden');
+            progressText.textContent = 'Uploading photos...';
             document.getElementById('fileInput').value = '';
         }
     }
 
-    async downloadPhoto(collection, filename) {
+    async uploadFileInChunks(collection, file, maxRetries = 3) {
+        const init = await this.uploadRequest('/api/admin/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                collection,
+                filename: file.name,
+                size: file.size,
+                fingerprint: `${file.lastModified}`
+            })
+        });
+
+        let offset = init.offset;
+        let retries = 0;
+
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + init.chunk_size);
+
+            try {
+                const data = await this.uploadRequest(`${init.upload_url}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: chunk
+                });
+                offset = data.offset;
+                retries = 0;
+            } catch (error) {
+                if (++retries > maxRetries) {
+                    throw error;
+                }
+                // Ask the server how much actually arrived before resending
+                const status = await this.uploadRequest(init.upload_url, { method: 'GET' });
+                offset = status.offset;
+            }
+        }
+
+        return this.uploadRequest(`${init.upload_url}/finalize`, { method: 'POST' });
+    }
+
+    async uploadRequest(url, options) {
+        const response = await fetch(url, options);
+        const data = await response.json();
+
+        if (!data.success) {
+            throw new Error(data.message);
+        }
+        return data;
+    }
+
+    async downloadPhoto(collection, filename, versionedUrl) {
         try {
-            const downloadUrl = `/api/photo/${encodeURIComponent(collection)}/${encodeURIComponent(filename)}/download`;
+            const downloadUrl = versionedUrl || `/api/photo/${encodeURIComponent(collection)}/${encodeURIComponent(filename)}/download`;
             
             // Create a temporary link and trigger download
             const link = document.createElement('a');
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from werkzeug.utils import secure_filename
+
+from src.filelock import flock
+
+# Partial uploads live next to their final location, hidden from listings
+UPLOAD_PREFIX = '.upload-'
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """Upload request that cannot be served; carries the HTTP status to return"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def write_stream(stream, dest_file, hasher=None, limit=None):
+    """Copy a stream into an open file in fixed-size blocks, hashing as it goes.
+
+    Returns the number of bytes written. Raises UploadError if more than
+    limit bytes arrive.
+    """
+    written = 0
+    while True:
+        block = stream.read(COPY_BUFFER_SIZE)
+        if not block:
+            return written
+        written += len(block)
+        if limit is not None and written > limit:
+            raise UploadError('Chunk exceeds the declared file size', 413)
+        dest_file.write(block)
+        if hasher is not None:
+            hasher.update(block)
+
+
+def place_unique(tmp_path, directory, filename):
+    """Move a finished temp file to directory/filename without clobbering.
+
+    Uses hard links, which fail atomically when the name is taken, so
+    concurrent uploads of the same name can't overwrite each other.
+    Returns the filename actually used.
+    """
+    base_name, ext = os.path.splitext(filename)
+    candidate, counter = filename, 1
+    while True:
+        try:
+            os.link(tmp_path, os.path.join(directory, candidate))
+            break
+        except FileExistsError:
+            candidate = f"{base_name}_{counter}{ext}"
+            counter += 1
+    os.remove(tmp_path)
+    return candidate
+
+
+class ChunkedUploads:
+    """Resumable uploads written chunk by chunk into the target collection.
+
+    An upload is identified by a hash of its collection, filename, size and
+    a client fingerprint, so re-initialising the same file resumes it.
+    Chunks must arrive in order; the SHA-256 is computed while streaming and
+    only rebuilt from disk when a different process picks the upload up.
+    """
+
+    def __init__(self, collections_dir, session_ttl=24 * 60 * 60):
+        self.collections_dir = collections_dir
+        self.session_ttl = session_ttl
+        self._lock = threading.Lock()
+        self._hashers = {}  # upload_id -> (offset, hasher)
+
+    def init(self, collection_name, filename, size, fingerprint=''):
+        """Start or resume an upload and return its state"""
+        collection_path = self._collection_path(collection_name)
+        self._expire_stale(collection_path)
+
+        upload_id = hashlib.sha256(
+            '\0'.join((collection_name, filename, str(size), fingerprint)).encode('utf-8')
+        ).hexdigest()[:32]
+        meta_path, part_path = self._paths(collection_path, upload_id)
+
+        if not os.path.exists(meta_path):
+            with open(part_path, 'wb'):
+                pass
+            with open(meta_path, 'w') as meta_file:
+                json.dump({'filename': filename, 'size': size, 'created': time.time()}, meta_file)
+
+        return self.status(collection_name, upload_id)
+
+    def status(self, collection_name, upload_id):
+        meta, _, part_path = self._load(collection_name, upload_id)
+        return {
+            'upload_id': upload_id,
+            'collection': collection_name,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'offset': os.path.getsize(part_path)
+        }
+
+    def write_chunk(self, collection_name, upload_id, offset, stream):
+        """Append a chunk at offset and return the new offset"""
+        meta, _, part_path = self._load(collection_name, upload_id)
+
+        with open(part_path, 'r+b') as part_file:
+            # One writer per upload, across threads and worker processes
+            flock(part_file)
+
+            received = os.fstat(part_file.fileno()).st_size
+            if offset != received:
+                raise UploadError('Chunk offset does not match received bytes', 409, offset=received)
+
+            hasher = self._hasher(upload_id, part_file, received)
+            part_file.seek(received)
+            written = write_stream(stream, part_file, hasher, limit=meta['size'] - received)
+            part_file.flush()
+
+            with self._lock:
+                self._hashers[upload_id] = (received + written, hasher)
+            return received + written
+
+    def finalize(self, collection_name, upload_id):
+        """Check a completed upload and return (filename, part path, sha256 hex digest)"""
+        meta, _, part_path = self._load(collection_name, upload_id)
+        received = os.path.getsize(part_path)
+        if received != meta['size']:
+            raise UploadError('Upload is incomplete', 409, offset=received)
+
+        with open(part_path, 'rb') as part_file:
+            digest = self._hasher(upload_id, part_file, received).hexdigest()
+        return meta['filename'], part_path, digest
+
+    def complete(self, collection_name, upload_id, placed=True):
+        """Forget a finalized upload; drops the partial file unless it was placed"""
+        meta_path, part_path = self._paths(self._collection_path(collection_name), upload_id)
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        paths = [meta_path] if placed else [meta_path, part_path]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _hasher(self, upload_id, part_file, received):
+        with self._lock:
+            offset, hasher = self._hashers.get(upload_id, (None, None))
+        if offset == received:
+            return hasher.copy()
+
+        # Resumed in another process or after a restart: rehash what we have
+        hasher = hashlib.sha256()
+        part_file.seek(0)
+        remaining = received
+        while remaining:
+            block = part_file.read(min(COPY_BUFFER_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+        return hasher
+
+    def _load(self, collection_name, upload_id):
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            raise UploadError('Upload not found', 404)
+        meta_path, part_path = self._paths(self._collection_path(collection_name), upload_id)
+        try:
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+        except FileNotFoundError:
+            raise UploadError('Upload not found', 404)
+        if not os.path.exists(part_path):
+            raise UploadError('Upload not found', 404)
+        return meta, meta_path, part_path
+
+    def _collection_path(self, collection_name):
+        # Names come from the client; only plain names like those create_collection
+        # makes may reach the filesystem, never '..' or an absolute path
+        if not collection_name or secure_filename(collection_name) != collection_name:
+            raise UploadError('Collection does not exist', 404)
+        collection_path = os.path.join(self.collections_dir, collection_name)
+        if not os.path.isdir(collection_path):
+            raise UploadError('Collection does not exist', 404)
+        return collection_path
+
+    def _paths(self, collection_path, upload_id):
+        base = os.path.join(collection_path, f'{UPLOAD_PREFIX}{upload_id}')
+        return f'{base}.json', f'{base}.part'
+
+    def _expire_stale(self, collection_path):
+        cutoff = time.time() - self.session_ttl
+        for name in os.listdir(collection_path):
+            if not name.startswith(UPLOAD_PREFIX):
+                continue
+            path = os.path.join(collection_path, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
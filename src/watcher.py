@@ -0,0 +1,225 @@
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import os
+import select
+import struct
+import tempfile
+import threading
+import time
+
+from src.filelock import flock
+
+logger = logging.getLogger(__name__)
+
+# inotify event bits (see <sys/inotify.h>)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+COLLECTION_MASK = (
+    IN_CLOSE_WRITE | IN_ATTRIB | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct('iIII')
+
+# Changes map a collection name to the set of changed filenames, or to
+# FULL_RESCAN when the whole collection has to be reconciled
+FULL_RESCAN = None
+
+
+def _load_inotify():
+    """libc's inotify functions, or None where they are unavailable"""
+    library = ctypes.util.find_library('c')
+    if library is None:
+        return None
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def _ignored(name):
+    # Dotfiles are partial uploads (.upload-*) and rsync temporaries (.name.XXXXXX)
+    return name.startswith('.')
+
+
+class CollectionWatcher:
+    """Notices files added, replaced or removed under COLLECTIONS_DIR.
+
+    Uses inotify on Linux and falls back to polling directory mtimes
+    elsewhere (or when inotify is unavailable, e.g. out of watches). Events
+    are debounced, then handed to on_change as {collection: filenames or
+    FULL_RESCAN}. Only one process per deployment runs it: the others wait
+    on a lock and take over if the current watcher's process exits.
+    """
+
+    def __init__(self, collections_dir, on_change, poll_interval=2.0, debounce=0.5):
+        self.collections_dir = os.path.abspath(collections_dir)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.backend = None
+        self._thread = None
+        self._lock_file = None
+
+    def start(self):
+        """Start the watcher thread; safe to call repeatedly"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='collection-watcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._acquire():
+            time.sleep(self.poll_interval)
+
+        libc = _load_inotify()
+        if libc is not None:
+            try:
+                self.backend = 'inotify'
+                self._watch_inotify(libc)
+                return
+            except OSError as e:
+                logger.warning('inotify unavailable (%s); polling %s instead', e, self.collections_dir)
+        self.backend = 'polling'
+        self._watch_polling()
+
+    def _acquire(self):
+        digest = hashlib.sha1(self.collections_dir.encode('utf-8')).hexdigest()[:16]
+        lock_file = open(os.path.join(tempfile.gettempdir(), f'gallery-watcher-{digest}.lock'), 'w')
+        if not flock(lock_file, blocking=False):
+            lock_file.close()
+            return False
+        # Held for the life of the process; the kernel releases it if we die
+        self._lock_file = lock_file
+        return True
+
+    def _emit(self, changes):
+        if not changes:
+            return
+        try:
+            self.on_change(changes)
+        except Exception:
+            logger.exception('Error applying collection changes')
+
+    # inotify backend
+
+    def _watch_inotify(self, libc):
+        fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        watches = {}  # watch descriptor -> collection name ('' for the root)
+
+        def add_watch(path, name, mask):
+            wd = libc.inotify_add_watch(fd, os.fsencode(path), mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {path}')
+            watches[wd] = name
+
+        try:
+            add_watch(self.collections_dir, '', ROOT_MASK)
+            for name in os.listdir(self.collections_dir):
+                if not _ignored(name) and os.path.isdir(os.path.join(self.collections_dir, name)):
+                    add_watch(os.path.join(self.collections_dir, name), name, COLLECTION_MASK)
+            # Catch anything that changed before the watches were in place
+            self._emit({name: FULL_RESCAN for name in watches.values() if name})
+
+            pending, deadline = {}, None
+            while True:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                readable, _, _ = select.select([fd], [], [], timeout)
+                if not readable:
+                    self._emit(pending)
+                    pending, deadline = {}, None
+                    continue
+
+                for wd, mask, name in self._read_events(fd):
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were lost: rescan everything we watch
+                        pending.update({collection: FULL_RESCAN for collection in watches.values() if collection})
+                        continue
+                    if mask & IN_IGNORED:
+                        watches.pop(wd, None)
+                        continue
+                    collection = watches.get(wd)
+                    if collection is None or _ignored(name):
+                        continue
+
+                    if collection == '':
+                        # A collection directory appeared, vanished or was renamed
+                        if mask & IN_ISDIR:
+                            path = os.path.join(self.collections_dir, name)
+                            if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                                add_watch(path, name, COLLECTION_MASK)
+                            pending[name] = FULL_RESCAN
+                    elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        pending[collection] = FULL_RESCAN
+                    elif not mask & IN_ISDIR and pending.get(collection, set()) is not FULL_RESCAN:
+                        pending.setdefault(collection, set()).add(name)
+
+                # rsync writes in bursts; wait for a quiet period before applying
+                deadline = time.monotonic() + self.debounce
+        finally:
+            os.close(fd)
+
+    def _read_events(self, fd):
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            yield wd, mask, name
+
+    # Polling backend
+
+    def _watch_polling(self):
+        # Renames and deletions update the directory mtime, which is what rsync
+        # and cp produce; in-place rewrites are picked up by a manual reconcile
+        snapshot = self._directory_mtimes()
+        self._emit({name: FULL_RESCAN for name in snapshot if name})
+        while True:
+            time.sleep(self.poll_interval)
+            current = self._directory_mtimes()
+            changed = {
+                name for name in set(snapshot) | set(current)
+                if name and snapshot.get(name) != current.get(name)
+            }
+            snapshot = current
+            self._emit({name: FULL_RESCAN for name in changed})
+
+    def _directory_mtimes(self):
+        mtimes = {}
+        try:
+            mtimes[''] = os.stat(self.collections_dir).st_mtime_ns
+            names = os.listdir(self.collections_dir)
+        except FileNotFoundError:
+            return mtimes
+        for name in names:
+            path = os.path.join(self.collections_dir, name)
+            if _ignored(name) or not os.path.isdir(path):
+                continue
+            try:
+                mtimes[name] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                pass
+        return mtimes
@@ -0,0 +1,178 @@
+import os
+import struct
+import time
+import zlib
+
+# Read size for streaming originals; memory use is bounded by this, not the archive
+ZIP_READ_SIZE = 1024 * 1024
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_ENTRY_LIMIT = 0xFFFF
+
+# General purpose flags: sizes and CRC follow the data (bit 3), UTF-8 names (bit 11)
+FLAG_DATA_DESCRIPTOR = 0x0008
+FLAG_UTF8 = 0x0800
+METHOD_STORED = 0
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+# "Made by" host system in the high byte: 3 = Unix, so external_attr holds file modes
+MADE_BY_UNIX = 3 << 8
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+ZIP64_END_LOCATOR = struct.Struct('<IIQI')
+
+
+class ZipEntry:
+    """A file to be stored in the archive, sized up front from its stat"""
+
+    def __init__(self, path, arcname, size, mtime):
+        self.path = path
+        self.arcname = arcname.encode('utf-8')
+        self.size = size
+        self.mtime = mtime
+        self.offset = 0
+        self.crc = 0
+
+    @property
+    def zip64(self):
+        return self.size >= ZIP64_LIMIT
+
+    def local_extra(self):
+        if not self.zip64:
+            return b''
+        return struct.pack('<HHQQ', 0x0001, 16, self.size, self.size)
+
+    def central_extra(self):
+        fields = []
+        if self.zip64:
+            fields += [self.size, self.size]
+        if self.offset >= ZIP64_LIMIT:
+            fields.append(self.offset)
+        if not fields:
+            return b''
+        return struct.pack(f'<HH{len(fields)}Q', 0x0001, 8 * len(fields), *fields)
+
+    def descriptor_size(self):
+        # signature + CRC + compressed and uncompressed sizes (8 bytes each in zip64)
+        return 24 if self.zip64 else 16
+
+    def local_size(self):
+        return LOCAL_HEADER.size + len(self.arcname) + len(self.local_extra()) + self.size + self.descriptor_size()
+
+    def central_size(self):
+        return CENTRAL_HEADER.size + len(self.arcname) + len(self.central_extra())
+
+
+def _dos_datetime(mtime):
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_time, dos_date
+
+
+class ZipStream:
+    """Uncompressed (STORED) ZIP archive generated on the fly.
+
+    Every size in a STORED archive is known from the file stats, so the
+    total length is computed before the first byte is sent. CRCs are
+    calculated while streaming and written in data descriptors after
+    each file. Zip64 records are added only when sizes, offsets or the
+    entry count overflow the classic format.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            offset += entry.local_size()
+        self.central_offset = offset
+        self.central_size = sum(entry.central_size() for entry in self.entries)
+
+    @classmethod
+    def from_paths(cls, paths):
+        """Build from (path, arcname) pairs, stat-ing each file"""
+        entries = []
+        for path, arcname in paths:
+            stat = os.stat(path)
+            entries.append(ZipEntry(path, arcname, stat.st_size, stat.st_mtime))
+        return cls(entries)
+
+    @property
+    def zip64(self):
+        return (
+            len(self.entries) >= ZIP64_ENTRY_LIMIT
+            or self.central_offset >= ZIP64_LIMIT
+            or self.central_size >= ZIP64_LIMIT
+        )
+
+    def __len__(self):
+        end_size = END_RECORD.size
+        if self.zip64:
+            end_size += ZIP64_END_RECORD.size + ZIP64_END_LOCATOR.size
+        return self.central_offset + self.central_size + end_size
+
+    def __iter__(self):
+        for entry in self.entries:
+            yield from self._local_file(entry)
+        yield from self._central_directory()
+
+    def _local_file(self, entry):
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        size = ZIP64_LIMIT if entry.zip64 else entry.size
+        extra = entry.local_extra()
+        yield LOCAL_HEADER.pack(
+            0x04034B50, VERSION_ZIP64 if entry.zip64 else VERSION_DEFAULT,
+            FLAG_DATA_DESCRIPTOR | FLAG_UTF8, METHOD_STORED, dos_time, dos_date,
+            0, size, size, len(entry.arcname), len(extra),
+        ) + entry.arcname + extra
+
+        crc = 0
+        remaining = entry.size
+        with open(entry.path, 'rb') as source:
+            while remaining:
+                block = source.read(min(ZIP_READ_SIZE, remaining))
+                if not block:
+                    # The advertised Content-Length can no longer be honoured
+                    raise IOError(f'{entry.path} shrank while it was being archived')
+                crc = zlib.crc32(block, crc)
+                remaining -= len(block)
+                yield block
+        entry.crc = crc
+
+        if entry.zip64:
+            yield struct.pack('<IIQQ', 0x08074B50, crc, entry.size, entry.size)
+        else:
+            yield struct.pack('<IIII', 0x08074B50, crc, entry.size, entry.size)
+
+    def _central_directory(self):
+        for entry in self.entries:
+            dos_time, dos_date = _dos_datetime(entry.mtime)
+            size = ZIP64_LIMIT if entry.zip64 else entry.size
+            extra = entry.central_extra()
+            yield CENTRAL_HEADER.pack(
+                0x02014B50, MADE_BY_UNIX | VERSION_ZIP64, VERSION_ZIP64 if extra else VERSION_DEFAULT,
+                FLAG_DATA_DESCRIPTOR | FLAG_UTF8, METHOD_STORED, dos_time, dos_date,
+                entry.crc, size, size, len(entry.arcname), len(extra), 0, 0, 0,
+                0o100644 << 16, min(entry.offset, ZIP64_LIMIT),
+            ) + entry.arcname + extra
+
+        count = len(self.entries)
+        if self.zip64:
+            zip64_end_offset = self.central_offset + self.central_size
+            yield ZIP64_END_RECORD.pack(
+                0x06064B50, ZIP64_END_RECORD.size - 12, VERSION_ZIP64, VERSION_ZIP64,
+                0, 0, count, count, self.central_size, self.central_offset,
+            )
+            yield ZIP64_END_LOCATOR.pack(0x07064B50, 0, zip64_end_offset, 1)
+
+        yield END_RECORD.pack(
+            0x06054B50, 0, 0,
+            min(count, ZIP64_ENTRY_LIMIT), min(count, ZIP64_ENTRY_LIMIT),
+            min(self.central_size, ZIP64_LIMIT), min(self.central_offset, ZIP64_LIMIT), 0,
+        )
@@ -0,0 +1,25 @@
+import threading
+
+from src.render_queue import RenderQueue
+
+
+def test_run_with_job_that_finishes_immediately():
+    # A cache hit returns before run() registers its done callback; the
+    # callback then runs in the calling thread and must not deadlock
+    queue = RenderQueue(max_workers=2, max_waiters=8, timeout=5)
+    results = []
+
+    def call(index):
+        for attempt in range(50):
+            results.append(queue.run((index, attempt), lambda value: value, attempt))
+
+    threads = [threading.Thread(target=call, args=(index,), daemon=True) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(results) == 200
+    assert queue.depth() == 0
+    assert queue.waiting() == 0